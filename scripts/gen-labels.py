@@ -1,11 +1,46 @@
 import arbor
+import label_table
 from arbor import mpoint
+from label_defs import regions, locsets
 
 def is_collocated(l, r):
     return l[0]==r[0] and l[1]==r[1]
 
+################################################################################
+# Label evaluation
+#
+# Labels referring to other labels are expanded first, so that labels with the
+# same meaning, eg 'soma' and 'tag1', are found to be one expression. All
+# labels go into one label_dict, in which arbor resolves a named sub-label, eg
+# the "tag3" inside "dend", once per cell, and one label per distinct
+# expression is queried.
+################################################################################
+
+# Concretise the distinct expressions on one morphology;
+# returns {expression: [(branch, prox, dist), ...]}, with prox==dist for locsets
+def evaluate_labels(morph, regions, locsets):
+    expanded = label_table.expand_labels({**regions, **locsets})
+    # the first label of every distinct expression
+    region_names = {}
+    for l in regions:
+        region_names.setdefault(expanded[l], l)
+    locset_names = {}
+    for l in locsets:
+        locset_names.setdefault(expanded[l], l)
+    cell = arbor.cable_cell(morph, arbor.label_dict({**regions, **locsets}))
+    result = {}
+    for expr, name in region_names.items():
+        result[expr] = [(c.branch, c.prox, c.dist) for c in cell.cables(name)]
+    for expr, name in locset_names.items():
+        result[expr] = [(l.branch, l.pos, l.pos) for l in cell.locations(name)]
+    return result
+
+def evaluate_swc(path, regions, locsets):
+    morph = arbor.morphology(arbor.load_swc_arbor(path))
+    return evaluate_labels(morph, regions, locsets)
+
 def write_morphology(name, morph):
-    string = 'tmp = ['.format(name)
+    string = 'morphologies[\'{}\'] = lambda: ['.format(name)
     for i in range(morph.num_branches):
         first = True
         sections = '['
@@ -25,7 +60,8 @@ def write_morphology(name, morph):
 
         string += '\n    [{}],'.format(sections)
     string += ']\n'
-    string += '{} = representation.make_morph(tmp)\n\n'.format(name)
+    parents = [-1 if morph.branch_parent(i)==mnpos else morph.branch_parent(i) for i in range(morph.num_branches)]
+    string += 'parents[\'{}\'] = {}\n\n'.format(name, parents)
     return string
 
 # Describe the morphologies
@@ -156,88 +192,98 @@ tree.append(mnpos, mpoint(-3.0,  0.0,  0.0, 1.5), mpoint(-5.5,-0.2,  0.0, 0.5),
 tree.append(8,     mpoint(-14.5,-0.1,  0.0, 0.5), tag=2)
 ysoma_morph3 = arbor.morphology(tree)
 
-regions  = {
-            'empty': '(nil)',
-            'all': '(all)',
-            'tag1': '(tag 1)',
-            'tag2': '(tag 2)',
-            'tag3': '(tag 3)',
-            'tag4': '(tag 4)',
-            'soma': '(region "tag1")',
-            'axon': '(region "tag2")',
-            'dend': '(join (region "tag3") (region "tag4"))',
-            'radlt5': '(radius_lt (all) 0.5)',
-            'radle5': '(radius_le (all) 0.5)',
-            'radgt5': '(radius_gt (all) 0.5)',
-            'radge5': '(radius_ge (all) 0.5)',
-            'rad36':  '(intersect (radius_gt (all) 0.3) (radius_lt (all) 0.6))',
-            'branch0': '(branch 0)',
-            'branch3': '(branch 3)',
-            'cable_1_01': '(cable 1 0 1)',
-            'cable_1_31': '(cable 1 0.3 1)',
-            'cable_1_37': '(cable 1 0.3 0.7)',
-            'proxint':     '(proximal_interval (locset "proxint_in") 5)',
-            'proxintinf':  '(proximal_interval (locset "proxint_in"))',
-            'distint':     '(distal_interval   (locset "distint_in") 5)',
-            'distintinf':  '(distal_interval   (locset "distint_in"))',
-            'lhs' : '(join (cable 0 0.5 1) (cable 1 0 0.5))',
-            'rhs' : '(branch 1)',
-            'and': '(intersect (region "lhs") (region "rhs"))',
-            'or':  '(join      (region "lhs") (region "rhs"))',
-          }
-locsets = {
-            'root': '(root)',
-            'term': '(terminal)',
-            'rand_dend': '(uniform (region "dend") 0 50 0)',
-            'loc15': '(location 1 0.5)',
-            'uniform0': '(uniform (tag 3) 0 9 0)',
-            'uniform1': '(uniform (tag 3) 0 9 1)',
-            'branchmid': '(on_branches 0.5)',
-            'distal':  '(distal   (region "rad36"))',
-            'proximal':'(proximal (region "rad36"))',
-            'distint_in': '(sum (location 1 0.5) (location 2 0.7) (location 5 0.1))',
-            'proxint_in': '(sum (location 1 0.8) (location 2 0.3))',
-            'loctest' : '(distal (complete (join (branch 1) (branch 0))))',
-            'restrict': '(restrict  (terminal) (tag 3))',
-          }
-
 labels = {**regions, **locsets}
-d = arbor.label_dict(labels)
 
-# Create a cell to concretise the region and locset definitions
-cell = arbor.cable_cell(label_morph, d)
+# inputs.py is a lazy registry: morphologies are only built, and the label
+# table only read, on first access of a name; results are cached as module
+# attributes.
+inputs_header = """import os
+import representation
+import label_table
+from representation import Segment
 
-################################################################################
-# Output all of the morphologies and reion/locset definitions to a Python script
-# that can be run during the documentation build to generate images.
-################################################################################
-f = open('inputs.py', 'w')
-f.write('import representation\n')
-f.write('from representation import Segment\n')
-
-f.write('\n############# morphologies\n\n')
-f.write(write_morphology('label_morph',    label_morph))
-f.write(write_morphology('detached_morph', detached_morph))
-f.write(write_morphology('stacked_morph',  stacked_morph))
-f.write(write_morphology('sphere_morph',   sphere_morph))
-f.write(write_morphology('branch_morph1',  branch_morph1))
-f.write(write_morphology('branch_morph2',  branch_morph2))
-f.write(write_morphology('branch_morph3',  branch_morph3))
-f.write(write_morphology('branch_morph4',  branch_morph4))
-f.write(write_morphology('yshaped_morph',  yshaped_morph))
-f.write(write_morphology('ysoma_morph1',   ysoma_morph1))
-f.write(write_morphology('ysoma_morph2',   ysoma_morph2))
-f.write(write_morphology('ysoma_morph3',   ysoma_morph3))
-
-f.write('\n############# locsets\n\n')
-for label in locsets:
-    locs = [(l.branch, l.pos) for l in cell.locations(label)]
-    f.write('ls_{}  = {{\'type\': \'locset\', \'value\': {}}}\n'.format(label, locs))
-
-f.write('\n############# regions\n\n')
-for label in regions:
-    comps = [(c.branch, c.prox, c.dist) for c in cell.cables(label)]
-    f.write('reg_{} = {{\'type\': \'region\', \'value\': {}}}\n'.format(label, comps))
-
-f.close()
+morphologies = {}
+parents = {}
+"""
+
+inputs_footer = """
+############# labels
+
+labels_file = os.path.join(os.path.dirname(__file__), '{}')
+labelled_morphology = '{}'
+table = None
+
+def __getattr__(name):
+    global table
+    if name in morphologies:
+        value = representation.make_morph(morphologies[name](), parents[name])
+    elif name.startswith(('ls_', 'reg_')):
+        if table is None:
+            table = label_table.load(labels_file)
+        kind, label = name.split('_', 1)
+        if label not in table.labels or table.kind(label) != {{'ls': 'locset', 'reg': 'region'}}[kind]:
+            raise AttributeError(name)
+        value = table.definition(labelled_morphology, label)
+    else:
+        raise AttributeError(name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    global table
+    if table is None:
+        table = label_table.load(labels_file)
+    return sorted(set(globals()) | set(morphologies) | set(table.definitions(labelled_morphology)))
+"""
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Concretise the regions and locsets.')
+    parser.add_argument('swc', nargs='*', help='evaluate the labels on these SWC files instead')
+    parser.add_argument('-o', '--out', default=None, help='label table, labels.npz by default; required with SWC files')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='worker processes')
+    args = parser.parse_args()
+
+    if args.swc:
+        # labels.npz is the table of the documentation, read by inputs.py
+        if args.out is None:
+            parser.error('the label table of SWC files needs -o')
+        from multiprocessing import Pool
+        from functools import partial
+
+        with Pool(args.processes) as pool:
+            results = pool.map(partial(evaluate_swc, regions=regions, locsets=locsets), args.swc)
+        label_table.write(args.out, args.swc, results, regions, locsets)
+        raise SystemExit
+
+    if args.out is None:
+        args.out = 'labels.npz'
+
+    # Concretise the region and locset definitions on the label morphology
+    label_table.write(args.out, ['label_morph'], [evaluate_labels(label_morph, regions, locsets)], regions, locsets)
+
+    ################################################################################
+    # Output all of the morphologies to a Python script that can be run
+    # during the documentation build to generate images.
+    ################################################################################
+    f = open('inputs.py', 'w')
+    f.write(inputs_header)
+
+    f.write('\n############# morphologies\n\n')
+    f.write(write_morphology('label_morph',    label_morph))
+    f.write(write_morphology('detached_morph', detached_morph))
+    f.write(write_morphology('stacked_morph',  stacked_morph))
+    f.write(write_morphology('sphere_morph',   sphere_morph))
+    f.write(write_morphology('branch_morph1',  branch_morph1))
+    f.write(write_morphology('branch_morph2',  branch_morph2))
+    f.write(write_morphology('branch_morph3',  branch_morph3))
+    f.write(write_morphology('branch_morph4',  branch_morph4))
+    f.write(write_morphology('yshaped_morph',  yshaped_morph))
+    f.write(write_morphology('ysoma_morph1',   ysoma_morph1))
+    f.write(write_morphology('ysoma_morph2',   ysoma_morph2))
+    f.write(write_morphology('ysoma_morph3',   ysoma_morph3))
+
+    f.write(inputs_footer.format(args.out, 'label_morph'))
 
+    f.close()
@@ -0,0 +1,48 @@
+# The region and locset definitions illustrated in the documentation.
+# Shared between gen-labels.py, which concretises them with arbor, and
+# label_eval.py, which evaluates them without.
+
+regions  = {
+            'empty': '(nil)',
+            'all': '(all)',
+            'tag1': '(tag 1)',
+            'tag2': '(tag 2)',
+            'tag3': '(tag 3)',
+            'tag4': '(tag 4)',
+            'soma': '(region "tag1")',
+            'axon': '(region "tag2")',
+            'dend': '(join (region "tag3") (region "tag4"))',
+            'radlt5': '(radius_lt (all) 0.5)',
+            'radle5': '(radius_le (all) 0.5)',
+            'radgt5': '(radius_gt (all) 0.5)',
+            'radge5': '(radius_ge (all) 0.5)',
+            'rad36':  '(intersect (radius_gt (all) 0.3) (radius_lt (all) 0.6))',
+            'branch0': '(branch 0)',
+            'branch3': '(branch 3)',
+            'cable_1_01': '(cable 1 0 1)',
+            'cable_1_31': '(cable 1 0.3 1)',
+            'cable_1_37': '(cable 1 0.3 0.7)',
+            'proxint':     '(proximal_interval (locset "proxint_in") 5)',
+            'proxintinf':  '(proximal_interval (locset "proxint_in"))',
+            'distint':     '(distal_interval   (locset "distint_in") 5)',
+            'distintinf':  '(distal_interval   (locset "distint_in"))',
+            'lhs' : '(join (cable 0 0.5 1) (cable 1 0 0.5))',
+            'rhs' : '(branch 1)',
+            'and': '(intersect (region "lhs") (region "rhs"))',
+            'or':  '(join      (region "lhs") (region "rhs"))',
+          }
+locsets = {
+            'root': '(root)',
+            'term': '(terminal)',
+            'rand_dend': '(uniform (region "dend") 0 50 0)',
+            'loc15': '(location 1 0.5)',
+            'uniform0': '(uniform (tag 3) 0 9 0)',
+            'uniform1': '(uniform (tag 3) 0 9 1)',
+            'branchmid': '(on_branches 0.5)',
+            'distal':  '(distal   (region "rad36"))',
+            'proximal':'(proximal (region "rad36"))',
+            'distint_in': '(sum (location 1 0.5) (location 2 0.7) (location 5 0.1))',
+            'proxint_in': '(sum (location 1 0.8) (location 2 0.3))',
+            'loctest' : '(distal (complete (join (branch 1) (branch 0))))',
+            'restrict': '(restrict  (terminal) (tag 3))',
+          }
@@ -0,0 +1,368 @@
+import re
+import math
+import numpy
+import representation
+
+# Evaluate region and locset expressions directly on a representation
+# Morphology, without arbor.
+#
+# Regions are lists of cables [(branch, prox, dist), ...], sorted with
+# overlapping and touching cables merged; locsets are sorted lists of
+# locations [(branch, pos), ...]. Positions are relative to the branch
+# length as seen by representation, which matches arbor for planar
+# morphologies. Every sub-expression is evaluated once per Evaluator.
+#
+# Differences to arbor:
+#   - uniform draws its samples from numpy's generator, so the locations
+#     follow the same distribution but differ from arbor's
+#   - the morphology must carry parent information for the operations that
+#     walk the tree (proximal/distal, intervals, terminal, complete)
+
+token_pattern = re.compile(r'\(|\)|"[^"]*"|[^\s()]+')
+
+class Quoted(str):
+    pass
+
+def parse(expr):
+    tokens = token_pattern.findall(expr)
+    def atom(tok):
+        if tok[0]=='"':
+            return Quoted(tok[1:-1])
+        try:
+            return int(tok)
+        except ValueError:
+            pass
+        try:
+            return float(tok)
+        except ValueError:
+            return tok
+    def read(i):
+        if tokens[i]!='(':
+            return atom(tokens[i]), i+1
+        node = []
+        i += 1
+        while tokens[i]!=')':
+            x, i = read(i)
+            node.append(x)
+        return tuple(node), i+1
+    node, i = read(0)
+    if i!=len(tokens):
+        raise Exception(f"Trailing input in expression: {expr}")
+    return node
+
+def merge(cables):
+    return [(b, p, d) for b, ivals in representation.merge_cables(cables).items() for p, d in ivals]
+
+class Evaluator:
+
+    def __init__(self, morph, regions=None, locsets=None):
+        self.morph = morph
+        self.labels = {'region': regions or {}, 'locset': locsets or {}}
+        self.cache = {}
+        self.nbranch = len(morph)
+        self.parents = morph.parents
+        if self.parents is not None:
+            self.children = [[] for _ in range(self.nbranch)]
+            for b, p in enumerate(self.parents):
+                if p>=0:
+                    self.children[p].append(b)
+
+    def tree(self):
+        if self.parents is None:
+            raise Exception("Operation needs branch parents, but the morphology has none")
+
+    # Evaluate an expression or the name of a label; returns (kind, value)
+    def evaluate(self, expr):
+        for kind, labels in self.labels.items():
+            if expr in labels:
+                return self.eval((kind, Quoted(expr)))
+        return self.eval(parse(expr))
+
+    def region(self, expr):
+        kind, value = self.evaluate(expr)
+        assert(kind=='region')
+        return value
+
+    def locset(self, expr):
+        kind, value = self.evaluate(expr)
+        assert(kind=='locset')
+        return value
+
+    def eval(self, node):
+        if node not in self.cache:
+            op = node[0].replace('-', '_')
+            fn = getattr(self, 'op_'+op, None)
+            if fn is None:
+                raise Exception(f"Unknown expression: {op}")
+            self.cache[node] = fn(*node[1:])
+        return self.cache[node]
+
+    # Branch geometry helpers
+
+    def blength(self, b):
+        return self.morph[b].length
+
+    def ancestors(self, b):
+        while self.parents[b]>=0:
+            b = self.parents[b]
+            yield b
+
+    def descendants(self, b):
+        stack = list(self.children[b])
+        while stack:
+            c = stack.pop()
+            yield c
+            stack += self.children[c]
+
+    # Relative positions (prox, dist) of all segments on branch b
+    def segment_range(self, b):
+        m = self.morph
+        lo, hi = m.branch_segments[b], m.branch_segments[b+1]
+        ends = m.ends[lo:hi]/m.ends[hi-1]
+        starts = numpy.concatenate([[0.0], ends[:-1]])
+        return lo, starts, ends
+
+    # References
+
+    def op_region(self, name):
+        kind, value = self.evaluate(self.labels['region'][name])
+        return 'region', value
+
+    def op_locset(self, name):
+        kind, value = self.evaluate(self.labels['locset'][name])
+        return 'locset', value
+
+    # Regions
+
+    def op_nil(self):
+        return 'region', []
+
+    def op_all(self):
+        return 'region', [(b, 0.0, 1.0) for b in range(self.nbranch)]
+
+    def op_branch(self, b):
+        return 'region', [(b, 0.0, 1.0)]
+
+    def op_cable(self, b, prox, dist):
+        return 'region', [(b, float(prox), float(dist))]
+
+    def op_tag(self, tag):
+        cables = []
+        for b in range(self.nbranch):
+            lo, starts, ends = self.segment_range(b)
+            tags = self.morph.segments['tag'][lo:lo+len(ends)]
+            cables += [(b, float(p), float(d)) for p, d, t in zip(starts, ends, tags) if t==tag]
+        return 'region', merge(cables)
+
+    def op_join(self, *args):
+        values = [self.eval(a) for a in args]
+        kinds = {k for k, _ in values}
+        if kinds=={'locset'}:
+            return 'locset', sorted(set(l for _, v in values for l in v))
+        assert(kinds=={'region'})
+        return 'region', merge([c for _, v in values for c in v])
+
+    def op_intersect(self, *args):
+        kind, result = self.eval(args[0])
+        for a in args[1:]:
+            _, rhs = self.eval(a)
+            if kind=='locset':
+                result = sorted(set(result) & set(rhs))
+                continue
+            out = []
+            for b, p, d in result:
+                for b2, p2, d2 in rhs:
+                    if b==b2 and max(p, p2)<=min(d, d2):
+                        out.append((b, max(p, p2), min(d, d2)))
+            result = merge(out)
+        return kind, result
+
+    def radius_predicate(self, reg, value, cmp, strict):
+        _, cables = self.eval(reg)
+        out = []
+        radii = self.morph.segments
+        for b, cp, cd in cables:
+            lo, starts, ends = self.segment_range(b)
+            for i in range(len(ends)):
+                s, e = starts[i], ends[i]
+                r0 = radii['prox'][lo+i][2]
+                r1 = radii['dist'][lo+i][2]
+                # The radius is linear along the segment, so the predicate
+                # holds on [0, 1], on one side of the crossing t, or nowhere.
+                a, c = cmp(r0, value), cmp(r1, value)
+                if not (a or c):
+                    continue
+                if a and c:
+                    t0, t1 = 0.0, 1.0
+                else:
+                    t = (value - r0)/(r1 - r0)
+                    t0, t1 = (0.0, t) if a else (t, 1.0)
+                p = max(s + t0*(e-s), cp)
+                d = min(s + t1*(e-s), cd)
+                if p<d or (p==d and not strict):
+                    out.append((b, float(p), float(d)))
+        return 'region', merge(out)
+
+    def op_radius_lt(self, reg, value):
+        return self.radius_predicate(reg, value, lambda r, v: r<v, True)
+
+    def op_radius_le(self, reg, value):
+        return self.radius_predicate(reg, value, lambda r, v: r<=v, False)
+
+    def op_radius_gt(self, reg, value):
+        return self.radius_predicate(reg, value, lambda r, v: r>v, True)
+
+    def op_radius_ge(self, reg, value):
+        return self.radius_predicate(reg, value, lambda r, v: r>=v, False)
+
+    def op_proximal_interval(self, ls, dist=math.inf):
+        self.tree()
+        _, locs = self.eval(ls)
+        cables = []
+        for b, pos in locs:
+            remaining = dist
+            while True:
+                L = self.blength(b)
+                if remaining>=pos*L:
+                    cables.append((b, 0.0, pos))
+                    remaining -= pos*L
+                    if self.parents[b]<0:
+                        break
+                    b, pos = self.parents[b], 1.0
+                else:
+                    cables.append((b, (pos*L - remaining)/L, pos))
+                    break
+        return 'region', merge(cables)
+
+    def op_distal_interval(self, ls, dist=math.inf):
+        self.tree()
+        _, locs = self.eval(ls)
+        cables = []
+        stack = [(b, pos, dist) for b, pos in locs]
+        while stack:
+            b, pos, remaining = stack.pop()
+            L = self.blength(b)
+            if remaining<=(1-pos)*L:
+                cables.append((b, pos, pos + remaining/L))
+            else:
+                cables.append((b, pos, 1.0))
+                stack += [(c, 0.0, remaining - (1-pos)*L) for c in self.children[b]]
+        return 'region', merge(cables)
+
+    # Add the zero length cables on the other side of all fork points
+    # touched by the region
+    def op_complete(self, reg):
+        self.tree()
+        _, cables = self.eval(reg)
+        roots = [b for b in range(self.nbranch) if self.parents[b]<0]
+        out = list(cables)
+        for b, p, d in cables:
+            if d==1:
+                out += [(c, 0.0, 0.0) for c in self.children[b]]
+            if p==0:
+                parent = self.parents[b]
+                if parent<0:
+                    out += [(s, 0.0, 0.0) for s in roots]
+                else:
+                    out.append((parent, 1.0, 1.0))
+                    out += [(s, 0.0, 0.0) for s in self.children[parent]]
+        return 'region', merge(out)
+
+    # Locsets
+
+    def op_root(self):
+        return 'locset', [(0, 0.0)]
+
+    def op_terminal(self):
+        self.tree()
+        return 'locset', [(b, 1.0) for b in range(self.nbranch) if not self.children[b]]
+
+    def op_location(self, b, pos):
+        return 'locset', [(b, float(pos))]
+
+    def op_on_branches(self, pos):
+        return 'locset', [(b, float(pos)) for b in range(self.nbranch)]
+
+    def op_sum(self, *args):
+        return 'locset', sorted(l for a in args for l in self.eval(a)[1])
+
+    def op_restrict(self, ls, reg):
+        _, locs = self.eval(ls)
+        _, cables = self.eval(reg)
+        return 'locset', [(b, pos) for b, pos in locs
+                          if any(b==cb and cp<=pos<=cd for cb, cp, cd in cables)]
+
+    def op_distal(self, reg):
+        self.tree()
+        _, cables = self.eval(reg)
+        covered = {b for b, _, _ in cables}
+        locs = []
+        for b, p, d in cables:
+            if any(cb==b and cp>d for cb, cp, _ in cables):
+                continue
+            if any(c in covered for c in self.descendants(b)):
+                continue
+            locs.append((b, d))
+        return 'locset', sorted(locs)
+
+    def op_proximal(self, reg):
+        self.tree()
+        _, cables = self.eval(reg)
+        covered = {b for b, _, _ in cables}
+        locs = []
+        for b, p, d in cables:
+            if any(cb==b and cd<p for cb, _, cd in cables):
+                continue
+            if any(a in covered for a in self.ancestors(b)):
+                continue
+            locs.append((b, p))
+        return 'locset', sorted(locs)
+
+    # Samples first..last of a uniform distribution over the region
+    def op_uniform(self, reg, first, last, seed):
+        _, cables = self.eval(reg)
+        if not cables:
+            return 'locset', []
+        lengths = numpy.array([(d-p)*self.blength(b) for b, p, d in cables])
+        cum = numpy.cumsum(lengths)
+        rng = numpy.random.default_rng(seed)
+        u = rng.random(last+1)[first:]*cum[-1]
+        idx = numpy.minimum(numpy.searchsorted(cum, u, side='right'), len(cables)-1)
+        locs = []
+        for i, x in zip(idx, u):
+            b, p, d = cables[i]
+            offset = x - (cum[i-1] if i>0 else 0.0)
+            locs.append((b, float(p + offset/self.blength(b))))
+        return 'locset', sorted(locs)
+
+    # All labels in the form used by make_images, cf. label_table.definitions
+    def definitions(self):
+        prefix = {'locset': 'ls_', 'region': 'reg_'}
+        result = {}
+        for kind, labels in self.labels.items():
+            for name in labels:
+                k, value = self.eval((kind, Quoted(name)))
+                result[prefix[k]+name] = {'type': k, 'value': value}
+        return result
+
+if __name__ == '__main__':
+    import argparse
+    import inputs
+    from label_defs import regions, locsets
+
+    parser = argparse.ArgumentParser(description='Preview labels without arbor.')
+    parser.add_argument('expr', nargs='*', help='label names or expressions, all labels by default')
+    parser.add_argument('-m', '--morph', default='label_morph', help='morphology from inputs.py')
+    parser.add_argument('-o', '--out', default=None, help='render the labels to this SVG')
+    args = parser.parse_args()
+
+    ev = Evaluator(getattr(inputs, args.morph), regions, locsets)
+    exprs = args.expr or list(regions) + list(locsets)
+    values = []
+    for expr in exprs:
+        kind, value = ev.evaluate(expr)
+        values.append({'type': kind, 'value': value})
+        print(f'{expr}: {kind} {value}')
+    if args.out:
+        import make_images
+        make_images.label_image(ev.morph, values, args.out)
@@ -0,0 +1,84 @@
+import re
+import numpy
+
+# Reader for the label tables written by gen-labels.py, see
+# write_label_table there for the layout.
+
+class LabelTable:
+
+    def __init__(self, data):
+        self.morphs = data['morphs'].tolist()
+        self.labels = data['labels'].tolist()
+        self.kinds = data['kinds'].tolist()
+        self.label_expr = data['label_expr']
+        self.offsets = data['offsets']
+        self.branch = data['branch']
+        self.prox = data['prox']
+        self.dist = data['dist']
+        self.nexpr = int(self.label_expr.max())+1 if len(self.label_expr) else 0
+
+    # Value of a label on a morphology in the form used by make_images:
+    # [(branch, pos), ...] for locsets, [(branch, prox, dist), ...] for regions
+    def value(self, morph, label):
+        if morph not in self.morphs:
+            raise Exception(f"No morphology {morph} in label table, only {', '.join(self.morphs)}")
+        m = self.morphs.index(morph)
+        l = self.labels.index(label)
+        i = m*self.nexpr + self.label_expr[l]
+        lo, hi = self.offsets[i], self.offsets[i+1]
+        branch = self.branch[lo:hi].tolist()
+        prox = self.prox[lo:hi].tolist()
+        if self.kinds[l]=='locset':
+            return list(zip(branch, prox))
+        return list(zip(branch, prox, self.dist[lo:hi].tolist()))
+
+    def kind(self, label):
+        return self.kinds[self.labels.index(label)]
+
+    def definition(self, morph, label):
+        return {'type': self.kind(label), 'value': self.value(morph, label)}
+
+    # All labels of a morphology as {'ls_<name>': ..., 'reg_<name>': ...}
+    def definitions(self, morph):
+        prefix = {'locset': 'ls_', 'region': 'reg_'}
+        return {prefix[k]+l: self.definition(morph, l) for l, k in zip(self.labels, self.kinds)}
+
+def load(filename):
+    with numpy.load(filename) as data:
+        return LabelTable(data)
+
+ref_pattern = re.compile(r'\((region|locset)\s+"([^"]*)"\)')
+
+def expand_labels(labels):
+    expanded = {}
+    def visit(name, stack):
+        if name in stack:
+            raise Exception(f"Cyclic label definition: {name}")
+        if name not in expanded:
+            expr = ref_pattern.sub(lambda m: visit(m.group(2), stack + [name]), labels[name])
+            expanded[name] = ' '.join(expr.split())
+        return expanded[name]
+    for name in labels:
+        visit(name, [])
+    return expanded
+
+# Store the label values of many morphologies as one table:
+#   morphs, labels, kinds:   names of morphologies and labels, 'region' or 'locset'
+#   label_expr:              index of the distinct expression of each label
+#   offsets:                 rows of (morph m, expression e) are
+#                            offsets[m*nexpr+e]:offsets[m*nexpr+e+1]
+#   branch, prox, dist:      the cables, or locations with prox==dist
+def write(filename, morphs, results, regions, locsets):
+    expanded = expand_labels({**regions, **locsets})
+    labels = list(regions) + list(locsets)
+    exprs = list(dict.fromkeys(expanded[l] for l in labels))
+    rows = [results[m][e] for m in range(len(morphs)) for e in exprs]
+    offsets = numpy.cumsum([0] + [len(r) for r in rows])
+    values = numpy.array([c for r in rows for c in r], dtype=numpy.float64).reshape(-1, 3)
+    numpy.savez_compressed(filename,
+                           morphs=numpy.array(morphs), labels=numpy.array(labels),
+                           kinds=numpy.array(['region']*len(regions) + ['locset']*len(locsets)),
+                           label_expr=numpy.array([exprs.index(expanded[l]) for l in labels], dtype=numpy.int32),
+                           offsets=offsets.astype(numpy.int64),
+                           branch=values[:, 0].astype(numpy.int32),
+                           prox=values[:, 1], dist=values[:, 2])
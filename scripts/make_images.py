@@ -1,11 +1,13 @@
 import copy
 import svgwrite
+import svgstream
 import math
 import inputs
+import representation
 import seaborn
 import pandas
 
-tag_colors = ['white', '#ffc2c2', 'gray', '#c2caff']
+tag_colors = ['white', '#ffc2c2', 'gray', '#c2caff', '#c2ffd0'] # undefined, soma, axon, dend, apic
 
 #
 # ############################################
@@ -27,13 +29,41 @@ def translate(x, f, xshift, yshift=0):
 def translate_all(points, f, xshift):
     return [translate(x, f, xshift) for x in points]
 
+# Resolve all (branch, pos) locations of a locset, one batched lookup
+# per branch.
+def locset_points(morph, locs):
+    positions = {}
+    for bid, pos in locs:
+        positions.setdefault(bid, []).append(pos)
+    points = []
+    for bid, pos in positions.items():
+        points += morph[bid].locations(pos)
+    return points
+
+# Drawing backends:
+#   'stream':   svgstream, writes compact SVG without validation
+#   'svgwrite': svgwrite with validation of every element, for debugging
+def drawing(filename, backend):
+    if backend=='svgwrite':
+        return svgwrite.Drawing(filename=filename, debug=True)
+    if backend=='stream':
+        return svgstream.Drawing(filename=filename)
+    raise Exception(f"Unknown backend: {backend}")
+
 # Draw one or more morphologies, side by side.
 # Each morphology can be drawn as segments or branches.
-def morph_image(morphs, methods, filename, locset=[], sc=5):
+#
+# For large morphologies:
+#   lod:  size in image units below which detail is dropped; runs of segments
+#         that deviate less than lod from a straight line are drawn as one,
+#         see Morphology.simplify
+#   view: (minx, miny, width, height) of the image, as for dwg.viewbox;
+#         geometry outside is not drawn. By default the image shows all.
+def morph_image(morphs, methods, filename, locset=[], sc=5, backend='stream', lod=None, view=None):
     assert(len(morphs)==len(methods))
 
     print('generating:', filename)
-    dwg = svgwrite.Drawing(filename=filename, debug=True)
+    dwg = drawing(filename, backend)
 
     # Width of lines and circle strokes.
     line_width=0.1*sc
@@ -72,24 +102,39 @@ def morph_image(morphs, methods, filename, locset=[], sc=5):
         method = methods[l]
 
         nbranches = len(morph)
+        extents = morph.minmax().tolist()
+        if lod:
+            morph = morph.simplify(lod/sc)
+        if view is None:
+            shown = [True]*len(morph.segments)
+            box = None
+        else:
+            # the view in the coordinates of this morphology; y is flipped
+            vx, vy, vw, vh = view
+            box = ((vx-offset)/sc, (vx+vw-offset)/sc, -(vy+vh)/sc, -vy/sc)
+            shown = morph.visible(box).tolist()
+        if method=='segments':
+            corners = morph.corners().tolist()
+            tags = morph.segments['tag'].tolist()
 
-        segid = 0
         for i in range(nbranches):
             branch = morph[i]
 
-            lx, ux, ly, uy = branch.minmax()
+            lx, ux, ly, uy = extents[i]
             minx = min(minx,  sc*lx+offset)
             miny = min(miny,  sc*ly)
             maxx = max(maxx,  sc*ux+offset)
             maxy = max(maxy,  sc*uy)
 
+            lo, hi = morph.branch_segments[i], morph.branch_segments[i+1]
+            if not any(shown[lo:hi]):
+                continue
+
             if method=='segments':
-                for sec in branch.sections:
-                    for seg in sec:
-                        if seg.length>0.00001: # only draw nonzero length segments
-                            line = translate_all(seg.corners(), sc, offset)
-                            lines.add(dwg.polygon(points=line, fill=tag_colors[seg.tag]))
-                        segid += 1
+                for segid in range(lo, hi):
+                    if morph.lengths[segid]>0.00001 and shown[segid]: # only draw nonzero length segments
+                        line = translate_all(corners[segid], sc, offset)
+                        lines.add(dwg.polygon(points=line, fill=tag_colors[tags[segid]]))
 
             elif method=='branches':
                 for line in branch.outline():
@@ -119,11 +164,10 @@ def morph_image(morphs, methods, filename, locset=[], sc=5):
                 points.add(dwg.circle(center=root, stroke='red', r=sc*0.5, fill='red'))
 
                 if lab['type'] == 'locset':
-                    for loc in lab['value']:
-                        bid = loc[0]
-                        pos = loc[1]
-
-                        loc = translate(morph[bid].location(pos), sc, offset)
+                    for loc in locset_points(morph, lab['value']):
+                        if box is not None and not (box[0]<=loc[0]<=box[1] and box[2]<=loc[1]<=box[3]):
+                            continue
+                        loc = translate(loc, sc, offset)
                         points.add(dwg.circle(center=loc, stroke='black', r=sc*0.5, fill='black'))
 
 
@@ -137,7 +181,10 @@ def morph_image(morphs, methods, filename, locset=[], sc=5):
     maxy += fudge
     width = maxx-minx
     height = maxy-miny
-    dwg.viewbox(minx, -maxy, width, height)
+    if view is None:
+        dwg.viewbox(minx, -maxy, width, height)
+    else:
+        dwg.viewbox(*view)
 
     # Write the image to file.
     dwg.save()
@@ -148,10 +195,10 @@ def morph_image(morphs, methods, filename, locset=[], sc=5):
 # ordering don't have collocated distal-proximal locations respectively.
 # Handling this case would make rendering regions more complex, but would
 # not bee too hard to support.
-def label_image(morphology, labels, filename, sc=20):
+def label_image(morphology, labels, filename, sc=20, backend='stream'):
     morph = morphology
     print('generating:', filename)
-    dwg = svgwrite.Drawing(filename=filename, debug=True)
+    dwg = drawing(filename, backend)
 
     # Width of lines and circle strokes.
     line_width=0.2*sc
@@ -184,12 +231,13 @@ def label_image(morphology, labels, filename, sc=20):
         lab = labels[l]
 
         nbranches = len(morph)
+        extents = morph.minmax().tolist()
 
         # Draw the outline of the cell
         for i in range(nbranches):
             branch = morph[i]
 
-            lx, ux, ly, uy = branch.minmax()
+            lx, ux, ly, uy = extents[i]
             minx = min(minx,  sc*lx+offset)
             miny = min(miny,  sc*ly)
             maxx = max(maxx,  sc*ux+offset)
@@ -205,28 +253,24 @@ def label_image(morphology, labels, filename, sc=20):
             root = translate(morph[0].location(0), sc, offset)
             points.add(dwg.circle(center=root, stroke='red', r=sc/2.5, fill='white'))
 
-            for loc in lab['value']:
-                bid = loc[0]
-                pos = loc[1]
-
-                loc = translate(morph[bid].location(pos), sc, offset)
+            for loc in locset_points(morph, lab['value']):
+                loc = translate(loc, sc, offset)
                 points.add(dwg.circle(center=loc, stroke='black', r=sc/3, fill='white'))
 
         if lab['type'] == 'region':
-            for cab in lab['value']:
-                # skip zero length cables
-                bid  = cab[0]
-                ppos = cab[1]
-                dpos = cab[2]
-
+            # Merge overlapping and touching cables, so that every
+            # contiguous interval is drawn as one outline.
+            for bid, cables in representation.merge_cables(lab['value']).items():
                 # Don't draw zero-length cables
                 # How should these be drawn: with a line or a circle?
-                if ppos==dpos: continue
+                cables = [c for c in cables if c[0]!=c[1]]
+                if not cables: continue
 
-                for line in morph[bid].outline(ppos, dpos):
-                    lines.add(dwg.polygon(points=translate_all(line, sc, offset),
-                                          fill='black',
-                                          stroke=branchfillcolor))
+                for outline in morph.outlines(bid, cables):
+                    for line in outline:
+                        lines.add(dwg.polygon(points=translate_all(line.tolist(), sc, offset),
+                                              fill='black',
+                                              stroke=branchfillcolor))
 
         offset = maxx - minx + sc
 
@@ -242,14 +286,82 @@ def label_image(morphology, labels, filename, sc=20):
     # Write the image to file.
     dwg.save()
 
-def generate(path=''):
-
-    # morph_image([inputs.label_morph, inputs.label_morph], ['segments', 'branches'], path+'/morph_branches.svg')
-    # label_image(inputs.label_morph, [inputs.ls_proxint_in, inputs.reg_proxintinf], path+'/points_region.svg')
-    morph_image([inputs.label_morph], ['segments'], path+'/morph.svg')
-    morph_image([inputs.label_morph], ['branches'], path+'/branches.svg',[inputs.ls_proxint_in])
-    # label_image(inputs.label_morph, [inputs.ls_proxint_in], path+'/points.svg')
-    label_image(inputs.label_morph, [inputs.reg_proxintinf], path+'/region.svg')
+# Figures as jobs: (function, positional arguments, output file name)
+def figures(path):
+    return [
+        # (morph_image, ([inputs.label_morph, inputs.label_morph], ['segments', 'branches']), path+'/morph_branches.svg'),
+        # (label_image, (inputs.label_morph, [inputs.ls_proxint_in, inputs.reg_proxintinf]), path+'/points_region.svg'),
+        (morph_image, ([inputs.label_morph], ['segments']), path+'/morph.svg'),
+        (morph_image, ([inputs.label_morph], ['branches'], [inputs.ls_proxint_in]), path+'/branches.svg'),
+        # (label_image, (inputs.label_morph, [inputs.ls_proxint_in]), path+'/points.svg'),
+        (label_image, (inputs.label_morph, [inputs.reg_proxintinf]), path+'/region.svg'),
+    ]
+
+# Hash of everything a figure depends on: the rendering code, the function,
+# and the content of all arguments.
+def job_hash(job):
+    import hashlib
+
+    def update(h, x):
+        if isinstance(x, representation.Morphology):
+            for a in [x.segments, x.section_offsets, x.branch_offsets]:
+                h.update(a.tobytes())
+        elif isinstance(x, (list, tuple)):
+            h.update(b'[')
+            for y in x:
+                update(h, y)
+            h.update(b']')
+        else:
+            h.update(repr(x).encode())
+
+    h = hashlib.sha256()
+    for mod in [__file__, representation.__file__, svgstream.__file__]:
+        with open(mod, 'rb') as fd:
+            h.update(fd.read())
+    fn, args, filename = job
+    update(h, (fn.__name__, args, filename))
+    return h.hexdigest()
+
+def render(job):
+    fn, args, filename = job
+    # both morph_image and label_image take the file name third
+    fn(*args[:2], filename, *args[2:])
+    return filename
+
+# Render all figures whose inputs changed since the last run; hashes are
+# kept in <path>/.figures.json. Stale figures are rendered on a process pool.
+def generate(path='', processes=None, force=False):
+    import os
+    import json
+    from concurrent.futures import ProcessPoolExecutor
+
+    manifest = os.path.join(path or '.', '.figures.json')
+    try:
+        with open(manifest) as fd:
+            hashes = json.load(fd)
+    except FileNotFoundError:
+        hashes = {}
+
+    jobs = figures(path)
+    stale = {}
+    for job in jobs:
+        filename = job[2]
+        h = job_hash(job)
+        if force or hashes.get(os.path.basename(filename))!=h or not os.path.exists(filename):
+            stale[filename] = (job, h)
+        else:
+            print('up to date:', filename)
+
+    if len(stale)>1 and processes!=1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            done = list(pool.map(render, [job for job, _ in stale.values()]))
+    else:
+        done = [render(job) for job, _ in stale.values()]
+
+    for filename in done:
+        hashes[os.path.basename(filename)] = stale[filename][1]
+    with open(manifest, 'w') as fd:
+        json.dump(hashes, fd, indent=1)
 
 if __name__ == '__main__':
     generate('.')
@@ -1,4 +1,5 @@
 import math
+import numpy as np
 
 def add_vec(u, v):
     return (u[0]+v[0], u[1]+v[1])
@@ -54,39 +55,258 @@ class Segment:
         return 'seg({}, {})'.format(self.prox, self.dist)
 
 
-# Represent and query a cable cell branch for rendering.
+# Array backed morphology.
+# All segments of all branches are stored in one structured array, in branch
+# and section order, with the sections and branches given as offsets:
+#   segments[section_offsets[s]:section_offsets[s+1]] are the segments of section s
+#   section_offsets[branch_offsets[b]:branch_offsets[b+1]+1] bound the sections of branch b
+# Geometry is computed for many segments at once; indexing yields a
+# Branch, a view of one branch on top of the arrays.
+# Optionally, parents holds the parent branch of each branch, -1 for
+# branches attached to the root.
+
+segment_dtype = [('prox', 'f8', 3), ('dist', 'f8', 3), ('tag', 'i4')] # x, y, radius
+
+class Morphology:
+
+    def __init__(self, segments, section_offsets, branch_offsets, parents=None):
+        self.segments = segments
+        self.parents = None if parents is None else np.asarray(parents, dtype=np.int64)
+        self.section_offsets = np.asarray(section_offsets, dtype=np.int64)
+        self.branch_offsets = np.asarray(branch_offsets, dtype=np.int64)
+        # segment offsets of the branches
+        self.branch_segments = self.section_offsets[self.branch_offsets]
+        d = segments['dist'][:, :2] - segments['prox'][:, :2]
+        self.lengths = np.sqrt(d[:, 0]*d[:, 0] + d[:, 1]*d[:, 1])
+        self.normals = self.segment_normals(d)
+        # cumulative length along the branch at the distal end of each segment
+        self.ends = np.empty(len(segments))
+        for b in range(len(self)):
+            lo, hi = self.branch_segments[b], self.branch_segments[b+1]
+            self.ends[lo:hi] = np.cumsum(self.lengths[lo:hi])
+        self.branches = [Branch(self, b) for b in range(len(self))]
+
+    def __len__(self):
+        return len(self.branch_offsets) - 1
+
+    def __getitem__(self, bid):
+        return self.branches[bid]
+
+    def __iter__(self):
+        return iter(self.branches)
+
+    # Unit normals of all segments in the plane, see Segment.corners. Segments
+    # without planar length, eg where only z or the radius changes, take the
+    # normal of the closest preceding segment on the branch with length, else
+    # of the closest following one.
+    def segment_normals(self, d):
+        n = len(d)
+        valid = self.lengths>0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            o = np.stack([d[:, 1]/self.lengths, -d[:, 0]/self.lengths], axis=1)
+        if valid.all():
+            return o
+        idx = np.arange(n)
+        branch_lo = np.repeat(self.branch_segments[:-1], np.diff(self.branch_segments))
+        branch_hi = np.repeat(self.branch_segments[1:], np.diff(self.branch_segments))
+        before = np.maximum.accumulate(np.where(valid, idx, -1))
+        after = np.minimum.accumulate(np.where(valid, idx, n)[::-1])[::-1]
+        src = np.where(before>=branch_lo, before, np.where(after<branch_hi, after, -1))
+        fix = ~valid
+        o[fix] = np.where((src[fix]>=0)[:, None], o[np.maximum(src[fix], 0)], (0.0, 1.0))
+        return o
+
+    # Corners [p1, p2, p3, p4] as (n, 4, 2) array of the segments in idx (all
+    # by default), each clipped to the relative positions prox..dist; see
+    # Segment.corners.
+    def corners(self, idx=slice(None), prox=0, dist=1):
+        seg = self.segments[idx]
+        prox = np.asarray(prox, dtype=np.float64)[..., None]
+        dist = np.asarray(dist, dtype=np.float64)[..., None]
+        b = seg['prox'] + prox*(seg['dist'] - seg['prox'])
+        e = seg['prox'] + dist*(seg['dist'] - seg['prox'])
+        o = self.normals[idx]
+        rb = b[:, 2:]
+        re = e[:, 2:]
+        return np.stack([b[:, :2] + rb*o, e[:, :2] + re*o,
+                         e[:, :2] - re*o, b[:, :2] - rb*o], axis=1)
+
+    # Lower and upper corners of the bounding boxes of all segments, (n, 2) each
+    def segment_boxes(self):
+        p = self.segments['prox']
+        d = self.segments['dist']
+        lo = np.minimum(p[:, :2] - p[:, 2:], d[:, :2] - d[:, 2:])
+        hi = np.maximum(p[:, :2] + p[:, 2:], d[:, :2] + d[:, 2:])
+        return lo, hi
+
+    # Bounding boxes (minx, maxx, miny, maxy) of all branches as (nbranch, 4)
+    def minmax(self):
+        lo, hi = self.segment_boxes()
+        starts = self.branch_segments[:-1]
+        lo = np.minimum.reduceat(lo, starts)
+        hi = np.maximum.reduceat(hi, starts)
+        return np.stack([lo[:, 0], hi[:, 0], lo[:, 1], hi[:, 1]], axis=1)
+
+    # Mask of the segments whose bounding box intersects box=(minx, maxx, miny, maxy)
+    def visible(self, box):
+        minx, maxx, miny, maxy = box
+        lo, hi = self.segment_boxes()
+        return (hi[:, 0]>=minx) & (lo[:, 0]<=maxx) & (hi[:, 1]>=miny) & (lo[:, 1]<=maxy)
+
+    # Simplified copy for drawing at resolution tol: runs of connected
+    # segments with the same tag are merged, as long as no dropped joint lies
+    # further than tol from the merged segment. Sections, branches and
+    # parents are kept, so labels still refer to the same branches.
+    def simplify(self, tol):
+        seg = self.segments
+        n = len(seg)
+        # a run ends before segment i if i starts a section, changes the tag,
+        # or does not start where i-1 ends (eg a jump in radius)
+        brk = np.ones(n, dtype=bool)
+        brk[1:] = (seg['tag'][1:]!=seg['tag'][:-1]) | np.any(seg['prox'][1:]!=seg['dist'][:-1], axis=1)
+        brk[self.section_offsets[:-1]] = True
+        starts = np.flatnonzero(brk)
+        stops = np.append(starts[1:], n)
+        # keep[i]: the distal end of segment i is a joint of the result
+        keep = np.zeros(n, dtype=bool)
+        for lo, hi in zip(starts, stops):
+            points = np.concatenate([seg['prox'][lo:lo+1], seg['dist'][lo:hi]])
+            keep[lo + simplify_joints(points, tol)] = True
+        kept = np.flatnonzero(keep)
+        first = np.concatenate([[0], kept[:-1]+1])
+        segments = np.empty(len(kept), dtype=segment_dtype)
+        segments['prox'] = seg['prox'][first]
+        segments['dist'] = seg['dist'][kept]
+        segments['tag'] = seg['tag'][kept]
+        # the last segment of every section is kept
+        section_offsets = np.searchsorted(kept, self.section_offsets)
+        return Morphology(segments, section_offsets, self.branch_offsets, self.parents)
+
+    # Flat index of the segment holding relative position(s) pos of branch bid
+    # and the position inside that segment; see Branch.segment_id.
+    def segment_index(self, bid, pos):
+        lo, hi = self.branch_segments[bid], self.branch_segments[bid+1]
+        ends = self.ends[lo:hi]
+        pos = np.asarray(pos, dtype=np.float64)
+        l = pos*ends[-1]
+        i = np.minimum(np.searchsorted(ends, l, side='left'), len(ends)-1)
+        part = np.where(i>0, ends[i-1], 0)
+        length = self.lengths[lo+i]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            segpos = np.where(length>0, (l-part)/length, 0.0)
+        i = np.where(pos==1, len(ends)-1, i)
+        segpos = np.where(pos==0, 0.0, np.where(pos==1, 1.0, segpos))
+        return lo+i, segpos
+
+    # Points (x, y, radius) at relative positions pos of branch bid
+    def locations(self, bid, pos):
+        i, segpos = self.segment_index(bid, pos)
+        seg = self.segments[i]
+        return seg['prox'] + segpos[..., None]*(seg['dist'] - seg['prox'])
+
+    # Outlines of the cable prox..dist on branch bid, one polygon per section
+    def outline(self, bid, prox=0, dist=1):
+        i, ppos = self.segment_index(bid, prox)
+        j, dpos = self.segment_index(bid, dist)
+        return self.range_outline(i, ppos, j, dpos)
+
+    # Outlines of the cables [(prox, dist), ...] on branch bid, resolving
+    # all end points in one lookup
+    def outlines(self, bid, cables):
+        cables = np.asarray(cables, dtype=np.float64).reshape(-1, 2)
+        i, ppos = self.segment_index(bid, cables[:, 0])
+        j, dpos = self.segment_index(bid, cables[:, 1])
+        return [self.range_outline(*args) for args in zip(i, ppos, j, dpos)]
+
+    # Outlines from position ppos on segment i to dpos on segment j
+    def range_outline(self, i, ppos, j, dpos):
+        ps = np.zeros(j-i+1)
+        ds = np.ones(j-i+1)
+        ps[0] = ppos
+        ds[-1] = dpos
+        c = self.corners(slice(i, j+1), ps, ds)
+        # split at section boundaries inside the range
+        bounds = self.section_offsets[(self.section_offsets>i) & (self.section_offsets<=j)] - i
+        outlines = []
+        for part in np.split(c, bounds):
+            if len(part)==1:
+                outlines.append(part[0])
+            else:
+                left = part[:, 0:2].reshape(-1, 2)
+                right = part[:, [3, 2]].reshape(-1, 2)[::-1]
+                outlines.append(np.concatenate([left, right]))
+        return outlines
+
+# Douglas-Peucker on a connected run of joints (x, y, radius), (k+1, 3):
+# every joint is compared to the linear interpolation between the kept
+# joints, parametrised by the length along the run, so that collinear and
+# short segments with linear radius collapse. Returns the indices of the
+# kept segments, ie of the joints after the first, including the last.
+def simplify_joints(points, tol):
+    d = points[1:, :2] - points[:-1, :2]
+    s = np.concatenate([[0.0], np.cumsum(np.sqrt(d[:, 0]*d[:, 0] + d[:, 1]*d[:, 1]))])
+    keep = np.zeros(len(points), dtype=bool)
+    keep[-1] = True
+    stack = [(0, len(points)-1)]
+    while stack:
+        a, b = stack.pop()
+        if b-a<2:
+            continue
+        t = (s[a+1:b]-s[a])/(s[b]-s[a]) if s[b]>s[a] else np.zeros(b-a-1)
+        err = np.linalg.norm(points[a+1:b] - (points[a] + t[:, None]*(points[b]-points[a])), axis=1)
+        i = int(np.argmax(err))
+        if err[i]>tol:
+            m = a+1+i
+            keep[m] = True
+            stack += [(a, m), (m, b)]
+    return np.flatnonzero(keep[1:])
+
+# Normalise a region given as [(branch, prox, dist), ...]: sort the cables
+# and merge overlapping or touching ones per branch.
+# Returns {branch: [(prox, dist), ...]}.
+def merge_cables(cables):
+    merged = {}
+    for bid, prox, dist in sorted(cables):
+        assert(prox<=dist)
+        ivals = merged.setdefault(bid, [])
+        if ivals and prox<=ivals[-1][1]:
+            ivals[-1] = (ivals[-1][0], max(ivals[-1][1], dist))
+        else:
+            ivals.append((prox, dist))
+    return merged
+
+# Represent and query a cable cell branch of a Morphology for rendering.
 # The branch is composed of segments, which are grouped into "sections".
 # A section is a fully connected sequence of segments, and a branch
 # will have more than one section if there are jumps/gaps between
 # segments.
 # The section representation makes things a bit messy, but it is required
 # to be able to draw morphologies with gaps.
-
 class Branch:
 
-    def __init__(self, sections):
-        self.sections = sections
-        length = 0
-        for sec in self.sections:
-            for seg in sec:
-                length += seg.length
-        self.length = length
+    def __init__(self, morph, bid):
+        self.morph = morph
+        self.bid = bid
+        self.length = morph.ends[morph.branch_segments[bid+1]-1]
 
-    def minmax(self):
-        minx = math.inf
-        miny = math.inf
-        maxx = -math.inf
-        maxy = -math.inf
-        for sec in self.sections:
-            for seg in sec:
-                px, py, pr = seg.prox
-                dx, dy, dr = seg.dist
-                minx = min(minx, px-pr, dx-dr)
-                miny = min(miny, py-pr, dy-dr)
-                maxx = max(maxx, px+pr, dx+dr)
-                maxy = max(maxy, py+pr, dy+dr)
+    # Segment objects, only built on access
+    @property
+    def sections(self):
+        m = self.morph
+        lo, hi = m.branch_offsets[self.bid], m.branch_offsets[self.bid+1]
+        return [[Segment(tuple(s['prox'].tolist()), tuple(s['dist'].tolist()), int(s['tag']))
+                 for s in m.segments[m.section_offsets[i]:m.section_offsets[i+1]]]
+                for i in range(lo, hi)]
 
-        return (minx, maxx, miny, maxy)
+    def minmax(self):
+        m = self.morph
+        lo, hi = m.branch_segments[self.bid], m.branch_segments[self.bid+1]
+        p = m.segments['prox'][lo:hi]
+        d = m.segments['dist'][lo:hi]
+        return (min((p[:, 0]-p[:, 2]).min(), (d[:, 0]-d[:, 2]).min()),
+                max((p[:, 0]+p[:, 2]).max(), (d[:, 0]+d[:, 2]).max()),
+                min((p[:, 1]-p[:, 2]).min(), (d[:, 1]-d[:, 2]).min()),
+                max((p[:, 1]+p[:, 2]).max(), (d[:, 1]+d[:, 2]).max()))
 
     # Return the segment location that contains the location
     # that is 0 ≤ pos ≤ 1 along the branch
@@ -97,88 +317,39 @@ class Branch:
     #       pos: relative position of the location inside the segment
     def segment_id(self, pos):
         assert(pos>=0 and pos<=1)
-        if pos==0:
-            return (0, 0, 0.0)
-        if pos==1:
-            return (len(self.sections)-1, len(self.sections[-1])-1, 1.0)
-        l = pos * self.length
-
-        part = 0
-        for secid in range(len(self.sections)):
-            sec = self.sections[secid]
-            for segid in range(len(sec)):
-                seg = sec[segid]
-                if part+seg.length >= l:
-                    segpos = (l-part)/seg.length
-                    return (secid, segid, segpos)
-
-                part += seg.length
+        m = self.morph
+        i, segpos = m.segment_index(self.bid, pos)
+        sec = np.searchsorted(m.section_offsets, i, side='right') - 1
+        return (int(sec - m.branch_offsets[self.bid]), int(i - m.section_offsets[sec]), float(segpos))
 
     def location(self, pos):
         assert(pos>=0 and pos<=1)
+        return tuple(self.morph.locations(self.bid, pos).tolist())
 
-        secid, segid, segpos = self.segment_id(pos)
-        return self.sections[secid][segid].location(segpos)
-
-    def sec_outline(self, secid, pseg, ppos, dseg, dpos):
-        sec = self.sections[secid]
-
-        # Handle the case where the cable is in one segment
-        if pseg==dseg:
-            assert(ppos<=dpos)
-            return sec[pseg].corners(ppos, dpos)
-
-        left = []
-        right = []
-
-        # Handle the partial partial proximal segment
-        p1, p2, p3, p4 = sec[pseg].corners(ppos, 1)
-        left += [p1, p2]
-        right += [p4, p3]
-
-        # Handle the full segments in the middle
-        for segid in range(pseg+1, dseg):
-            p1, p2, p3, p4 = sec[segid].corners()
-            left += [p1, p2]
-            right += [p4, p3]
-
-        # Handle the partial distal segment
-        p1, p2, p3, p4 = sec[dseg].corners(0, dpos)
-        left += [p1, p2]
-        right += [p4, p3]
-
-        right.reverse()
-        return left + right
-
-
+    def locations(self, positions):
+        return [tuple(l) for l in self.morph.locations(self.bid, positions).tolist()]
 
     # Return outline of all (sub)sections in the branch between the relative
     # locations: 0 ≤ prox ≤ dist ≤ 1
     def outline(self, prox=0, dist=1):
-        psec, pseg, ppos = self.segment_id(prox)
-        dsec, dseg, dpos = self.segment_id(dist)
-
-        if psec==dsec and pseg==dseg:
-            return [self.sections[psec][pseg].corners(ppos, dpos)]
-        if psec==dsec:
-            return [self.sec_outline(psec, pseg, ppos, dseg, dpos)]
-
-        outlines = [self.sec_outline(psec, pseg, ppos, len(self.sections[psec])-1, 1)]
-        for secid in range(psec+1,dsec):
-            outlines.append(self.sec_outline(secid, 0, 0, len(self.sections[secid])-1, 1))
-        outlines.append(self.sec_outline(dsec, 0, 0, dseg, dpos))
-
-        return outlines
+        return [[tuple(p) for p in o.tolist()] for o in self.morph.outline(self.bid, prox, dist)]
 
 # A morphology for rendering is a flat list of branches, with no
 # parent-child information for the branches.
 # Each branch is itself a list of sections, where each section
 # represents a sequence of segments with no gaps.
+# make_morph packs such a list into a Morphology.
 
-def make_morph(branches):
-    m = []
+def make_morph(branches, parents=None):
+    segments = []
+    section_offsets = [0]
+    branch_offsets = [0]
     for branch_sections in branches:
-        m.append(Branch(branch_sections))
+        for sec in branch_sections:
+            for seg in sec:
+                segments.append((seg.prox, seg.dist, seg.tag))
+            section_offsets.append(len(segments))
+        branch_offsets.append(len(section_offsets)-1)
 
-    return m
+    return Morphology(np.array(segments, dtype=segment_dtype), section_offsets, branch_offsets, parents)
 
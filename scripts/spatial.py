@@ -0,0 +1,153 @@
+import math
+import numpy as np
+
+# Spatial queries on a representation.Morphology.
+#
+# The segments are binned into a uniform grid by their bounding boxes (see
+# Morphology.segment_boxes), so a query only looks at the segments in the
+# cells it touches instead of all of them. Results are locations
+# (branch, pos) on the centre line of the branches, the locset form used by
+# inputs.py and label_eval.py.
+
+class SegmentGrid:
+
+    # cell: edge length of the grid cells, by default chosen such that there
+    # are about as many cells as segments, but no smaller than the mean
+    # extent of the segment bounding boxes
+    def __init__(self, morph, cell=None):
+        self.morph = morph
+        seg = morph.segments
+        self.prox = seg['prox'][:, :2]
+        self.dist = seg['dist'][:, :2]
+        self.branch = np.searchsorted(morph.branch_segments, np.arange(len(seg)), side='right') - 1
+        self.branch_length = morph.ends[morph.branch_segments[1:]-1]
+
+        lo, hi = morph.segment_boxes()
+        if cell is None:
+            area = np.prod(hi.max(axis=0) - lo.min(axis=0))
+            cell = max(math.sqrt(area/len(seg)), float(np.mean(hi - lo)), 1e-9)
+        self.cell = cell
+        self.origin = lo.min(axis=0)
+        self.shape = (np.floor((hi.max(axis=0) - self.origin)/cell).astype(np.int64) + 1)
+
+        # (cell, segment) pairs for every cell touched by a bounding box,
+        # stored sorted by cell with offsets per cell
+        c0 = self.cell_of(lo)
+        c1 = self.cell_of(hi)
+        counts = (c1 - c0 + 1).prod(axis=1)
+        segs = np.repeat(np.arange(len(seg)), counts)
+        # position of every pair inside the box of cells of its segment
+        k = np.arange(len(segs)) - np.repeat(np.cumsum(counts) - counts, counts)
+        w = np.repeat(c1[:, 0] - c0[:, 0] + 1, counts)
+        ix = np.repeat(c0[:, 0], counts) + k % w
+        iy = np.repeat(c0[:, 1], counts) + k // w
+        cells = ix*self.shape[1] + iy
+        order = np.argsort(cells, kind='stable')
+        self.segments = segs[order]
+        self.offsets = np.searchsorted(cells[order], np.arange(self.shape.prod() + 1))
+
+    def cell_of(self, points):
+        c = np.floor((np.asarray(points) - self.origin)/self.cell).astype(np.int64)
+        return np.clip(c, 0, self.shape - 1)
+
+    # Segments in the cells ix0..ix1, iy0..iy1 (inclusive), without duplicates
+    def candidates(self, ix0, ix1, iy0, iy1):
+        ix0, iy0 = max(ix0, 0), max(iy0, 0)
+        ix1, iy1 = min(ix1, self.shape[0]-1), min(iy1, self.shape[1]-1)
+        if ix0>ix1 or iy0>iy1:
+            return np.empty(0, dtype=np.int64)
+        parts = [self.segments[self.offsets[ix*self.shape[1]+iy0]:self.offsets[ix*self.shape[1]+iy1+1]]
+                 for ix in range(ix0, ix1+1)]
+        return np.unique(np.concatenate(parts))
+
+    # Closest points of segments idx to point p: (distance, relative position)
+    def project(self, idx, p):
+        a = self.prox[idx]
+        d = self.dist[idx] - a
+        dd = (d*d).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(dd>0, ((p - a)*d).sum(axis=1)/dd, 0.0)
+        t = np.clip(t, 0, 1)
+        r = a + t[:, None]*d - p
+        return np.sqrt((r*r).sum(axis=1)), t
+
+    # Location (branch, pos) of relative position t on segment i
+    def location(self, i, t):
+        m = self.morph
+        b = int(self.branch[i])
+        L = self.branch_length[b]
+        pos = (m.ends[i] - (1-t)*m.lengths[i])/L if L>0 else 0.0
+        return (b, min(max(float(pos), 0.0), 1.0))
+
+    # Location closest to the point (x, y) and its distance. The search
+    # square around the point grows until it holds the closest segment:
+    # every segment within r*cell of the point touches the square of radius
+    # r cells.
+    def nearest(self, point):
+        p = np.asarray(point, dtype=np.float64)
+        cx, cy = np.floor((p - self.origin)/self.cell).astype(np.int64).tolist()
+        nx, ny = self.shape.tolist()
+        # start with the smallest square that reaches the grid
+        r = max(0, -cx, -cy, cx-nx+1, cy-ny+1)
+        last = max(cx, cy, nx-1-cx, ny-1-cy)
+        seen = np.empty(0, dtype=np.int64)
+        best = (math.inf, None, None)
+        while True:
+            # the squares are nested, so only check the new segments
+            square = self.candidates(cx-r, cx+r, cy-r, cy+r)
+            idx = np.setdiff1d(square, seen, assume_unique=True)
+            seen = square
+            if len(idx):
+                dist, t = self.project(idx, p)
+                k = int(np.argmin(dist))
+                if dist[k]<best[0]:
+                    best = (float(dist[k]), int(idx[k]), float(t[k]))
+            if best[0]<=r*self.cell or r>=last:
+                break
+            r = max(2*r, 1)
+        return self.location(best[1], best[2]), best[0]
+
+    # Locations closest to each of many points, see nearest
+    def nearest_all(self, points):
+        return [self.nearest(p)[0] for p in points]
+
+    # The closest location on every branch within radius of the point,
+    # ordered by distance: [((branch, pos), distance), ...]
+    def within(self, point, radius):
+        p = np.asarray(point, dtype=np.float64)
+        (ix0, iy0), (ix1, iy1) = ((np.floor((p - radius - self.origin)/self.cell)).astype(np.int64).tolist(),
+                                  (np.floor((p + radius - self.origin)/self.cell)).astype(np.int64).tolist())
+        idx = self.candidates(ix0, ix1, iy0, iy1)
+        dist, t = self.project(idx, p)
+        keep = dist<=radius
+        idx, dist, t = idx[keep], dist[keep], t[keep]
+        found = {}
+        for k in np.argsort(dist, kind='stable').tolist():
+            b = int(self.branch[idx[k]])
+            if b not in found:
+                found[b] = (self.location(idx[k], t[k]), float(dist[k]))
+        return list(found.values())
+
+    # Locations of the centre line inside the box (minx, maxx, miny, maxy):
+    # the middle of the part inside the box of every segment crossing it,
+    # sorted
+    def box(self, box):
+        minx, maxx, miny, maxy = box
+        (ix0, iy0), (ix1, iy1) = (np.floor((np.array([minx, miny]) - self.origin)/self.cell).astype(np.int64).tolist(),
+                                  np.floor((np.array([maxx, maxy]) - self.origin)/self.cell).astype(np.int64).tolist())
+        idx = self.candidates(ix0, ix1, iy0, iy1)
+        a = self.prox[idx]
+        d = self.dist[idx] - a
+        # clip the segments to the box, cf. Liang-Barsky
+        t0 = np.zeros(len(idx))
+        t1 = np.ones(len(idx))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for k, lo, hi in [(0, minx, maxx), (1, miny, maxy)]:
+                u = (lo - a[:, k])/d[:, k]
+                v = (hi - a[:, k])/d[:, k]
+                parallel = d[:, k]==0
+                inside = (a[:, k]>=lo) & (a[:, k]<=hi)
+                t0 = np.where(parallel, np.where(inside, t0, 1.0), np.maximum(t0, np.minimum(u, v)))
+                t1 = np.where(parallel, np.where(inside, t1, 0.0), np.minimum(t1, np.maximum(u, v)))
+        hit = t0<=t1
+        return sorted(self.location(i, t) for i, t in zip(idx[hit].tolist(), (0.5*(t0+t1))[hit].tolist()))
@@ -0,0 +1,84 @@
+import tempfile
+from xml.sax.saxutils import escape, quoteattr
+
+# Minimal drop-in for the parts of svgwrite.Drawing used by make_images.
+#
+# Elements are serialised as soon as they are added to a group, without any
+# validation, and each group spools its content to a temporary file. Only
+# the viewbox, which is known last, is kept until save() writes the header
+# and concatenates the groups.
+
+def fmt(x):
+    if isinstance(x, float):
+        return '{:.6g}'.format(x)
+    return str(x)
+
+def attributes(attrs):
+    return ''.join(' {}={}'.format(k.replace('_', '-'), quoteattr(fmt(v))) for k, v in attrs.items())
+
+class Element:
+    def __init__(self, tag, text=None, **attrs):
+        self.tag = tag
+        self.text = text
+        self.attrs = attrs
+
+    def tostring(self):
+        if self.text is None:
+            return '<{}{}/>'.format(self.tag, attributes(self.attrs))
+        return '<{0}{1}>{2}</{0}>'.format(self.tag, attributes(self.attrs), escape(self.text))
+
+class Group(Element):
+    def __init__(self, **attrs):
+        Element.__init__(self, 'g', **attrs)
+        self.body = tempfile.TemporaryFile('w+')
+
+    def add(self, element):
+        self.body.write(element.tostring())
+        self.body.write('\n')
+        return element
+
+class Drawing:
+    def __init__(self, filename, **kwargs):
+        self.filename = filename
+        self.children = []
+        self.box = None
+
+    def add(self, element):
+        self.children.append(element)
+        return element
+
+    def g(self, **attrs):
+        return Group(**attrs)
+
+    def polygon(self, points, **attrs):
+        return Element('polygon', points=' '.join('{},{}'.format(fmt(float(x)), fmt(float(y))) for x, y in points), **attrs)
+
+    def circle(self, center, r, **attrs):
+        return Element('circle', cx=float(center[0]), cy=float(center[1]), r=r, **attrs)
+
+    def text(self, text, insert, **attrs):
+        return Element('text', text, x=float(insert[0]), y=float(insert[1]), **attrs)
+
+    def viewbox(self, minx, miny, width, height):
+        self.box = (minx, miny, width, height)
+
+    def save(self):
+        with open(self.filename, 'w') as fd:
+            fd.write('<?xml version="1.0" encoding="utf-8" ?>\n')
+            attrs = {'xmlns': 'http://www.w3.org/2000/svg', 'version': '1.1',
+                     'width': '100%', 'height': '100%'}
+            if self.box is not None:
+                attrs['viewBox'] = ' '.join(fmt(float(x)) for x in self.box)
+            fd.write('<svg{}>\n'.format(attributes(attrs)))
+            for child in self.children:
+                if isinstance(child, Group):
+                    fd.write('<g{}>\n'.format(attributes(child.attrs)))
+                    child.body.seek(0)
+                    for chunk in iter(lambda: child.body.read(1<<16), ''):
+                        fd.write(chunk)
+                    child.body.close()
+                    fd.write('</g>\n')
+                else:
+                    fd.write(child.tostring())
+                    fd.write('\n')
+            fd.write('</svg>\n')
@@ -0,0 +1,175 @@
+import mmap
+import numpy as np
+import representation
+
+# Read SWC files straight into a representation.Morphology, without arbor.
+#
+# The file is memory-mapped and parsed in chunks of lines, so apart from the
+# current chunk only the numeric sample table is held in memory. Branches and
+# sections are then built with array operations:
+#   - a branch starts at every segment attached to the root and every child
+#     of a fork, as in arbor
+#   - a branch is split into sections wherever a segment does not start at
+#     the distal end of the previous one, cf. is_collocated in gen-labels.py
+# Geometry is projected onto the x-y plane, like all of representation.
+#
+# Interpretations:
+#   'arbor': every sample but the root is the distal end of a segment from
+#            its parent sample
+#   'allen': the soma sample is a cylinder along y with the length of its
+#            diameter; dendrites start at their first sample, leaving a gap to
+#            the soma, unless no_gaps is set, in which case they start at the
+#            soma center
+
+# (id, tag, x, y, z, r, parent) as (n, 7) array, parsed chunk by chunk
+def read_samples(path, chunk=1<<16):
+    parts = []
+    with open(path, 'rb') as fd:
+        if fd.seek(0, 2)==0: # cannot map empty files
+            raise Exception(f"Empty SWC file: {path}")
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            lines = []
+            for line in iter(data.readline, b''):
+                line = line.split(b'#', 1)[0]
+                if line.strip():
+                    lines.append(line)
+                if len(lines)==chunk:
+                    parts.append(parse_lines(lines, path))
+                    lines = []
+            if lines:
+                parts.append(parse_lines(lines, path))
+    if not parts:
+        raise Exception(f"No samples in SWC file: {path}")
+    return np.concatenate(parts)
+
+def parse_lines(lines, path):
+    values = np.array(b' '.join(lines).split(), dtype=np.float64)
+    if len(values)!=7*len(lines):
+        raise Exception(f"Malformed SWC record in {path}")
+    return values.reshape(-1, 7)
+
+def load_swc(path, interpretation='arbor', no_gaps=False):
+    samples = read_samples(path)
+    ids = samples[:, 0].astype(np.int64)
+    if np.any(np.diff(ids)<=0):
+        raise Exception(f"SWC samples are not sorted by id: {path}")
+    # index of the parent sample, -1 for the root
+    pid = samples[:, 6].astype(np.int64)
+    parent = np.searchsorted(ids, pid)
+    root = pid<0
+    parent[root] = -1
+    if root.sum()!=1 or not root[0]:
+        raise Exception(f"SWC file needs exactly one root, the first sample: {path}")
+    if np.any(~root & ((parent>=np.arange(len(ids))) | (ids[np.minimum(parent, len(ids)-1)]!=pid))):
+        raise Exception(f"SWC sample with missing or later parent: {path}")
+
+    tag = samples[:, 1].astype(np.int32)
+    point = samples[:, [2, 3, 5]] # x, y, radius
+    n = len(samples)
+
+    if interpretation=='arbor':
+        # segment k-1 ends at sample k
+        seg_sample = np.arange(1, n)
+        prox = point[parent[1:]]
+        seg_parent = parent[1:] - 1 # the root has no segment: -1
+    elif interpretation=='allen':
+        if tag[0]!=1:
+            raise Exception(f"Allen SWC files start with a soma sample: {path}")
+        x, y, r = point[0]
+        on_soma = parent==0
+        if not no_gaps:
+            # dendrites start at their first sample
+            has_segment = ~root & ~on_soma
+        else:
+            has_segment = ~root
+        seg_sample = np.concatenate([[0], np.flatnonzero(has_segment)])
+        # segment of every sample: the one ending there, the soma otherwise
+        seg_of = np.zeros(n, dtype=np.int64)
+        seg_of[seg_sample] = np.arange(len(seg_sample))
+        prox = point[np.maximum(parent[seg_sample], 0)]
+        prox[0] = (x, y-r, r)
+        if no_gaps:
+            soma_child = on_soma[seg_sample]
+            prox[soma_child, :2] = (x, y)
+            prox[soma_child, 2] = point[seg_sample[soma_child], 2]
+        seg_parent = seg_of[np.maximum(parent[seg_sample], 0)]
+        seg_parent[0] = -1
+    else:
+        raise Exception(f"Unknown SWC interpretation: {interpretation}")
+
+    dist = point[seg_sample]
+    if interpretation=='allen':
+        dist[0] = (x, y+r, r)
+    return make_tree(prox, dist, tag[seg_sample], seg_parent)
+
+# Build the Morphology of a segment tree given as arrays, where the parent of
+# every segment precedes it, -1 for the root
+def make_tree(prox, dist, tag, seg_parent):
+    nseg = len(seg_parent)
+    if nseg==0:
+        raise Exception("Morphology without segments")
+    attached = seg_parent>=0
+    children = np.bincount(seg_parent[attached], minlength=nseg)
+    start = ~attached
+    start[attached] = children[seg_parent[attached]]!=1
+
+    # Every segment continues the branch of its parent, unless it starts a
+    # new one; branches are numbered by their first segment.
+    branch = np.cumsum(start) - 1
+    bp = branch.tolist()
+    sp = seg_parent.tolist()
+    for k, s in enumerate(start.tolist()):
+        if not s:
+            bp[k] = bp[sp[k]]
+    branch = np.array(bp, dtype=np.int64)
+
+    # Parents precede children, so sorting by branch keeps every branch in
+    # order from proximal to distal.
+    order = np.argsort(branch, kind='stable')
+    prox, dist, tag, branch = prox[order], dist[order], tag[order], branch[order]
+    first = np.flatnonzero(start)
+    branch_parents = np.where(attached[first], branch[np.argsort(order)[np.maximum(seg_parent[first], 0)]], -1)
+
+    # New section at branch starts and wherever the segment does not
+    # start at the distal end of its predecessor
+    new_section = np.ones(nseg, dtype=bool)
+    new_section[1:] = (branch[1:]!=branch[:-1]) | np.any(prox[1:, :2]!=dist[:-1, :2], axis=1)
+    section_offsets = np.append(np.flatnonzero(new_section), nseg)
+    branch_offsets = np.searchsorted(section_offsets, np.append(np.searchsorted(branch, np.arange(len(first))), nseg))
+
+    segments = np.empty(nseg, dtype=representation.segment_dtype)
+    segments['prox'] = prox
+    segments['dist'] = dist
+    segments['tag'] = tag
+    return representation.Morphology(segments, section_offsets, branch_offsets, branch_parents)
+
+def render(path, out, interpretation, sc, lod):
+    import os
+    import make_images
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    filename = os.path.join(out, name + '.svg')
+    make_images.morph_image([load_swc(path, interpretation)], ['segments'], filename, sc=sc, lod=lod)
+    return filename
+
+if __name__ == '__main__':
+    import os
+    import argparse
+    from functools import partial
+    from multiprocessing import Pool
+
+    parser = argparse.ArgumentParser(description='Render SWC files to SVG.')
+    parser.add_argument('swc', nargs='+', help='SWC files')
+    parser.add_argument('-o', '--out', default='.', help='output directory')
+    parser.add_argument('-j', '--processes', type=int, default=None, help='worker processes')
+    parser.add_argument('--allen', action='store_true', help='use the Allen interpretation')
+    parser.add_argument('--sc', type=float, default=1, help='image units per µm')
+    parser.add_argument('--lod', type=float, default=0.5, help='smallest feature drawn, in image units')
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    task = partial(render, out=args.out, interpretation='allen' if args.allen else 'arbor',
+                   sc=args.sc, lod=args.lod)
+    with Pool(args.processes) as pool:
+        for _ in pool.imap_unordered(task, args.swc, chunksize=8):
+            pass
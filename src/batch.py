@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+# Run many Allen Brain Atlas models on a process pool.
+#
+# Input is either a directory holding one sub-directory per cell, each with
+# exactly one .swc and one .json file, or a manifest with one line per cell:
+#
+#   name swc fit
+#
+# Paths in a manifest are relative to the manifest itself. Every cell writes
+# its spikes and traces to the trace directory <out>/<name>, see traces.py,
+# along with the timing report profile.json, see phases.py; a failing cell
+# leaves a <name>.err with the traceback and the batch carries on.
+#
+# Screening runs (--screen) record spikes only: no voltage probe, no trace
+# files, no plots. Every cell yields one compact record, appended to
+# <out>/screen.jsonl as soon as it finishes.
+
+import os
+import sys
+import glob
+import time
+import traceback
+
+def read_manifest(path):
+    if os.path.isdir(path):
+        jobs = []
+        for d in sorted(os.listdir(path)):
+            cell = os.path.join(path, d)
+            if not os.path.isdir(cell):
+                continue
+            swc = glob.glob(os.path.join(cell, '*.swc'))
+            fit = glob.glob(os.path.join(cell, '*.json'))
+            if len(swc) != 1 or len(fit) != 1:
+                print(f'skipping {cell}: need exactly one .swc and one .json', file=sys.stderr)
+                continue
+            jobs.append((d, swc[0], fit[0]))
+        return jobs
+
+    root = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    with open(path) as fd:
+        for line in fd:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            name, swc, fit = line.split()
+            jobs.append((name, os.path.join(root, swc), os.path.join(root, fit)))
+    return jobs
+
+# Simulate one cell and store the results; never raises, so that a single
+# broken cell cannot take down the pool. Samples are streamed to disk while
+# the simulation runs, see traces.run_streaming, so peak memory does not
+# grow with the length of the trace.
+def run_one(job, out, tfinal=1400, dt=0.005, frequency=200000, cache_dir=None):
+    import arbor as arb
+    import cache
+    import traces
+    import phases
+    import network
+
+    name, swc, fit = job
+    start = time.perf_counter()
+    rec = phases.recorder(name=name, swc=swc, fit=fit, tfinal=tfinal, dt=dt)
+    try:
+        store = cache.store(cache_dir) if cache_dir else None
+        context = arb.context()
+        rec.attach(context)
+        with rec.phase('cell'):
+            recipe = network.allen_recipe([job], [], store=store, synapse=False)
+            sim = arb.simulation(recipe, arb.partition_load_balance(recipe, context), context)
+        with rec.phase('run'):
+            # the probe at the soma center is written as time0/value0
+            traces.run_streaming(sim, {'0': (0, 0)}, os.path.join(out, name), tfinal, dt, frequency)
+        rec.write(os.path.join(out, name, 'profile.json'))
+    except Exception:
+        with open(os.path.join(out, name + '.err'), 'w') as fd:
+            fd.write(traceback.format_exc())
+        return name, False, time.perf_counter() - start
+    return name, True, time.perf_counter() - start
+
+# Simulate one cell for its spikes only; like run_one, never raises.
+def screen_one(job, tfinal=1400, dt=0.005, cache_dir=None):
+    import utils
+    import cache
+
+    name, swc, fit = job
+    start = time.perf_counter()
+    record = {'name': name}
+    try:
+        store = cache.store(cache_dir) if cache_dir else None
+        cell = utils.make_allen_cell(swc, fit, store=store)
+        model = utils.make_allen_model(cell, frequency=None)
+        model.run(tfinal=tfinal, dt=dt)
+        spikes = [round(t, 4) for t in model.spikes]
+        record.update(ok=True, spike_count=len(spikes), spikes=spikes, error='')
+    except Exception as e:
+        record.update(ok=False, spike_count=0, spikes=[], error=f'{type(e).__name__}: {e}')
+    record['elapsed'] = time.perf_counter() - start
+    return record
+
+def run_screen(jobs, out, processes=None, **kwargs):
+    from multiprocessing import Pool
+    from functools import partial
+    import json
+
+    os.makedirs(out, exist_ok=True)
+    task = partial(screen_one, **kwargs)
+    records = []
+    # Without traces little state builds up, so workers are reused for a
+    # while to save the start-up cost per cell.
+    with open(os.path.join(out, 'screen.jsonl'), 'a') as fd, \
+         Pool(processes=processes, maxtasksperchild=32) as pool:
+        for record in pool.imap_unordered(task, jobs, chunksize=1):
+            fd.write(json.dumps(record) + '\n')
+            fd.flush()
+            print(f'{record["name"]}: {record["error"] or str(record["spike_count"]) + " spikes"} ({record["elapsed"]:.1f}s)')
+            records.append(record)
+    return records
+
+def run_batch(jobs, out, processes=None, **kwargs):
+    from multiprocessing import Pool
+    from functools import partial
+
+    os.makedirs(out, exist_ok=True)
+    task = partial(run_one, out=out, **kwargs)
+    results = []
+    # One cell per task and a fresh worker per cell: runtimes differ widely
+    # between reconstructions and Arbor state should not accumulate.
+    with Pool(processes=processes, maxtasksperchild=1) as pool:
+        for name, ok, elapsed in pool.imap_unordered(task, jobs, chunksize=1):
+            print(f'{name}: {"ok" if ok else "FAILED"} ({elapsed:.1f}s)')
+            results.append((name, ok, elapsed))
+    return results
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a batch of Allen models.')
+    parser.add_argument('input', help='directory of cells or manifest file')
+    parser.add_argument('-o', '--out', default='out', help='output directory')
+    parser.add_argument('-j', '--processes', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('--tfinal', type=float, default=1400)
+    parser.add_argument('--dt', type=float, default=0.005)
+    parser.add_argument('--frequency', type=float, default=200000, help='voltage sampling frequency')
+    parser.add_argument('--cache', default=None, help='cache directory for parsed inputs')
+    parser.add_argument('--screen', action='store_true', help='record spikes only, into <out>/screen.jsonl')
+    args = parser.parse_args()
+
+    if args.screen:
+        records = run_screen(read_manifest(args.input), args.out, args.processes,
+                             tfinal=args.tfinal, dt=args.dt, cache_dir=args.cache)
+        results = [(r['name'], r['ok'], r['elapsed']) for r in records]
+    else:
+        results = run_batch(read_manifest(args.input), args.out, args.processes,
+                            tfinal=args.tfinal, dt=args.dt, frequency=args.frequency,
+                            cache_dir=args.cache)
+    failed = [name for name, ok, _ in results if not ok]
+    print(f'{len(results) - len(failed)}/{len(results)} cells succeeded')
+    sys.exit(1 if failed else 0)
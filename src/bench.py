@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Accuracy vs cost of discretisation and time step.
+#
+# Runs an Allen model across a ladder of compartment lengths and time steps
+# and compares every run against a fine-resolution reference run of the
+# same cell. Each run happens in a fresh worker process, so peak memory is
+# attributable to that run alone. Runs are executed one at a time by
+# default to keep wall times comparable.
+
+import os
+import time
+
+cv_lengths = [100, 50, 20, 10, 5, 2]
+dts = [0.025, 0.01, 0.005, 0.0025]
+reference = (1, 0.001)
+
+def run_one(setting, swc, fit, tfinal=1400, frequency=20000):
+    import resource
+    import numpy as np
+    import utils
+
+    cv_length, dt = setting
+    cell = utils.make_allen_cell(swc, fit, cv_length=cv_length)
+    model = utils.make_allen_model(cell, frequency=frequency)
+    start = time.perf_counter()
+    model.run(tfinal=tfinal, dt=dt)
+    wall = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 # kB -> MB
+    return (setting, wall, peak,
+            np.array(model.traces[0].time[:]), np.array(model.traces[0].value[:]))
+
+# Mark rows not dominated in (wall, rmse) by any other row
+def pareto(rows):
+    front = []
+    for r in rows:
+        front.append(not any(o['wall'] <= r['wall'] and o['rmse'] <= r['rmse'] and
+                             (o['wall'] < r['wall'] or o['rmse'] < r['rmse']) for o in rows))
+    return front
+
+def run_bench(swc, fit, settings=None, processes=1, **kwargs):
+    from multiprocessing import Pool
+    from functools import partial
+    import itertools
+    import numpy as np
+    import validate
+
+    if settings is None:
+        settings = list(itertools.product(cv_lengths, dts))
+    task = partial(run_one, swc=swc, fit=fit, **kwargs)
+    with Pool(processes=processes, maxtasksperchild=1) as pool:
+        _, ref_wall, ref_peak, ref_t, ref_v = pool.apply(task, (reference,))
+        print(f'reference {reference}: {ref_wall:.1f}s {ref_peak:.0f}MB')
+        ref = np.stack([ref_t, ref_v], axis=1)
+        rows = []
+        for (cv_length, dt), wall, peak, t, v in pool.imap(task, settings):
+            row = {'cv_length': cv_length, 'dt': dt, 'wall': wall, 'peak_mb': peak,
+                   **validate.compare(t, v, ref, shift=0.0)}
+            print(f'{cv_length:>6} {dt:>7}: {wall:.1f}s {peak:.0f}MB rmse={row["rmse"]:.2f}mV')
+            rows.append(row)
+    for row, front in zip(rows, pareto(rows)):
+        row['pareto'] = front
+    return rows
+
+# The fastest setting meeting the tolerances, None if there is none
+def fastest(rows, limits=None):
+    import validate
+
+    ok = [r for r in rows if validate.check(r, limits or validate.tolerances)]
+    return min(ok, key=lambda r: r['wall']) if ok else None
+
+if __name__ == '__main__':
+    import argparse
+    import csv
+    import itertools
+
+    parser = argparse.ArgumentParser(description='Benchmark discretisations of an Allen model.')
+    parser.add_argument('swc')
+    parser.add_argument('fit')
+    parser.add_argument('-o', '--out', default='bench.csv', help='result table')
+    parser.add_argument('-j', '--processes', type=int, default=1, help='concurrent runs')
+    parser.add_argument('--tfinal', type=float, default=1400)
+    parser.add_argument('--cv-length', type=float, nargs='+', default=cv_lengths)
+    parser.add_argument('--dt', type=float, nargs='+', default=dts)
+    args = parser.parse_args()
+
+    rows = run_bench(os.path.abspath(args.swc), os.path.abspath(args.fit),
+                     list(itertools.product(args.cv_length, args.dt)),
+                     args.processes, tfinal=args.tfinal)
+    with open(args.out, 'w', newline='') as fd:
+        writer = csv.DictWriter(fd, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    print('pareto front:')
+    for r in sorted((r for r in rows if r['pareto']), key=lambda r: r['wall']):
+        print(f'  cv_length={r["cv_length"]} dt={r["dt"]}: {r["wall"]:.1f}s rmse={r["rmse"]:.2f}mV')
+    best = fastest(rows)
+    if best:
+        print(f'fastest within tolerance: cv_length={best["cv_length"]} dt={best["dt"]}')
+    else:
+        print('no setting within tolerance')
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# Content addressed on-disk cache.
+#
+# Entries are opaque blobs stored as <root>/<key[:2]>/<key>, where the key is
+# the SHA-256 of whatever identifies the content (typically the bytes of an
+# input file plus loader options). Reads bump the modification time, so
+# eviction drops the least recently used entries once the total size exceeds
+# the configured bound.
+
+import os
+import hashlib
+
+default_root = os.environ.get('ALLEN_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'allen'))
+
+def digest(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode()
+        h.update(part)
+        h.update(b'\0')
+    return h.hexdigest()
+
+def file_digest(path, *parts):
+    with open(path, 'rb') as fd:
+        return digest(fd.read(), *parts)
+
+class store:
+    def __init__(self, root=default_root, max_bytes=256*1024*1024):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as fd:
+                data = fd.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return data
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write and rename, so concurrent readers never see partial entries
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as fd:
+            fd.write(data)
+        os.replace(tmp, path)
+        self.evict()
+
+    def entries(self):
+        result = []
+        for d in os.listdir(self.root):
+            sub = os.path.join(self.root, d)
+            if not os.path.isdir(sub):
+                continue
+            for f in os.listdir(sub):
+                if f.endswith('.tmp'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(sub, f))
+                except FileNotFoundError: # evicted by somebody else
+                    continue
+                result.append((st.st_mtime, st.st_size, os.path.join(sub, f)))
+        return result
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
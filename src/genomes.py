@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+# Columnar view of the genome blocks of many Allen fits.
+#
+# All blocks of all fits end up in flat NumPy columns, one row per block:
+#
+#   cell:      index into table.cells
+#   section:   index into table.sections
+#   mechanism: index into table.mechanisms ('pas' for the empty mechanism)
+#   name:      index into table.names, after the same renaming as
+#              utils.load_allen_fit ('g_pas' -> 'g', 'Ra' -> 'rL', ...)
+#   value:     float64, after the same transformations (cm/100, celsius+273.15)
+#   prop:      True for cell properties (cm, rL, Vm, tempK), False for
+#              mechanism parameters
+#
+# The per-cell (default, regions, ions, mechanisms) tuples as returned by
+# load_allen_fit are derived on demand through table.fit(i).
+
+import json
+import numpy as np
+
+from utils import parameters
+
+# pas properties: original name -> (name, scale, offset)
+pas_properties = {'cm':      ('cm',    0.01, 0.0),
+                  'Ra':      ('rL',    1.0,  0.0),
+                  'Vm':      ('Vm',    1.0,  0.0),
+                  'celsius': ('tempK', 1.0,  273.15)}
+
+class genome_table:
+    def __init__(self, cells, sections, mechanisms, names, columns, conditions):
+        self.cells = cells
+        self.sections = sections
+        self.mechanisms = mechanisms
+        self.names = names
+        self.conditions = conditions
+        for k in ['cell', 'section', 'mechanism', 'name', 'value', 'prop']:
+            setattr(self, k, columns[k])
+        # rows are grouped by cell; offsets[i]:offsets[i+1] are the rows of cell i
+        self.offsets = np.searchsorted(self.cell, np.arange(len(cells) + 1))
+
+    def __len__(self):
+        return len(self.value)
+
+    # Boolean row mask for the given labels, eg select(mechanism='NaV', name='gbar')
+    def select(self, cell=None, section=None, mechanism=None, name=None):
+        mask = np.ones(len(self), dtype=bool)
+        for col, labels, label in [(self.cell,      self.cells,      cell),
+                                   (self.section,   self.sections,   section),
+                                   (self.mechanism, self.mechanisms, mechanism),
+                                   (self.name,      self.names,      name)]:
+            if label is not None:
+                mask &= col == labels.index(label)
+        return mask
+
+    # Rebuild the load_allen_fit tuple of cell i from the table
+    def fit(self, i):
+        from collections import defaultdict
+
+        lo, hi = self.offsets[i], self.offsets[i+1]
+        param = defaultdict(parameters)
+        mechs = defaultdict(dict)
+        for s, m, n, v, p in zip(self.section[lo:hi], self.mechanism[lo:hi],
+                                 self.name[lo:hi], self.value[lo:hi], self.prop[lo:hi]):
+            region = self.sections[s]
+            name = self.names[n]
+            if p:
+                setattr(param[region], name, float(v))
+            else:
+                mechs[(region, self.mechanisms[m])][name] = float(v)
+        param = [(r, vs) for r, vs in param.items()]
+        mechs = [(r, m, vs) for (r, m), vs in mechs.items()]
+
+        celsius, v_init, ra, erev = self.conditions[i]
+        default = parameters(None, celsius + 273.15, v_init, ra)
+        return default, param, list(erev), mechs
+
+    def fits(self):
+        for i in range(len(self.cells)):
+            yield self.cells[i], self.fit(i)
+
+    def save(self, path):
+        np.savez(path,
+                 cells=np.array(self.cells), sections=np.array(self.sections),
+                 mechanisms=np.array(self.mechanisms), names=np.array(self.names),
+                 conditions=np.array(json.dumps(self.conditions)),
+                 **{k: getattr(self, k) for k in ['cell', 'section', 'mechanism', 'name', 'value', 'prop']})
+
+def load_table(path):
+    with np.load(path) as data:
+        columns = {k: data[k] for k in ['cell', 'section', 'mechanism', 'name', 'value', 'prop']}
+        conditions = [(c, v, r, [tuple(e) for e in erev]) for c, v, r, erev in json.loads(str(data['conditions']))]
+        return genome_table(data['cells'].tolist(), data['sections'].tolist(),
+                            data['mechanisms'].tolist(), data['names'].tolist(),
+                            columns, conditions)
+
+def load_conditions(fit):
+    erev = []
+    for kv in fit['conditions'][0]['erev']:
+        region = kv['section']
+        for k, v in kv.items():
+            if k == 'section':
+                continue
+            erev.append((region, k[1:], float(v)))
+    return (float(fit['conditions'][0]['celsius']),
+            float(fit['conditions'][0]['v_init']),
+            float(fit['passive'][0]['ra']),
+            erev)
+
+# Parse a list of fit files into a genome_table. The ids default to the
+# file names.
+def load_genomes(fits, ids=None):
+    if ids is None:
+        ids = list(fits)
+    cell, section, mech, name, value = [], [], [], [], []
+    conditions = []
+    for i, path in enumerate(fits):
+        with open(path) as fd:
+            fit = json.load(fd)
+        for block in fit['genome']:
+            cell.append(i)
+            section.append(block['section'])
+            mech.append(block['mechanism'] or 'pas')
+            name.append(block['name'])
+            value.append(block['value'])
+        conditions.append(load_conditions(fit))
+
+    cell = np.array(cell, dtype=np.int32)
+    value = np.array(value, dtype=np.float64)
+    sections, section = np.unique(np.array(section, dtype=str), return_inverse=True)
+    mechanisms, mech = np.unique(np.array(mech, dtype=str), return_inverse=True)
+    raw_names, raw_name = np.unique(np.array(name, dtype=str), return_inverse=True)
+    mechanisms = mechanisms.tolist()
+
+    # Classify each distinct (mechanism, name) pair once, then apply the
+    # renaming and value transformations to all rows at once.
+    pairs, pair = np.unique(mech*len(raw_names) + raw_name, return_inverse=True)
+    names = []
+    pair_name = np.empty(len(pairs), dtype=np.int64)
+    scale = np.ones(len(pairs))
+    offset = np.zeros(len(pairs))
+    prop = np.zeros(len(pairs), dtype=bool)
+    for k, p in enumerate(pairs):
+        m = mechanisms[p // len(raw_names)]
+        n = str(raw_names[p % len(raw_names)])
+        if n.endswith('_' + m):
+            n = n[:-(len(m) + 1)]
+        elif m == 'pas':
+            if n not in pas_properties:
+                raise Exception(f"Unknown key: {n}")
+            n, scale[k], offset[k] = pas_properties[n]
+            prop[k] = True
+        else:
+            raise Exception(f"Illegal combination {m} {n}")
+        if n not in names:
+            names.append(n)
+        pair_name[k] = names.index(n)
+
+    columns = {'cell':      cell,
+               'section':   section.astype(np.int32),
+               'mechanism': mech.astype(np.int32),
+               'name':      pair_name[pair].astype(np.int32),
+               'value':     value*scale[pair] + offset[pair],
+               'prop':      prop[pair]}
+    return genome_table(list(ids), sections.tolist(), mechanisms, names, columns, conditions)
+
+if __name__ == '__main__':
+    import sys
+
+    table = load_genomes(sys.argv[1:])
+    print(f'{len(table.cells)} cells, {len(table)} parameters')
+    for m, mech in enumerate(table.mechanisms):
+        for n, name in enumerate(table.names):
+            vs = table.value[(table.mechanism == m) & (table.name == n)]
+            if len(vs):
+                print(f'{mech:>12} {name:>8}: n={len(vs):6d} mean={vs.mean(): .4g} std={vs.std(): .4g} min={vs.min(): .4g} max={vs.max(): .4g}')
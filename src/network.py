@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+# Simulate a population of Allen models in a single Arbor simulation.
+#
+# Cells are given as a list of (name, swc, fit) triples, see batch.py for the
+# manifest format; the gid of a cell is its index in that list. Every cell
+# gets the stimulus and spike detector from model.py plus one 'expsyn'
+# target at the soma center. Connections are read from a table with one
+# line per connection:
+#
+#   source target weight delay
+#
+# with source and target given as gids.
+
+import utils
+import arbor as arb
+
+def read_connections(path):
+    conns = []
+    with open(path) as fd:
+        for line in fd:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            src, tgt, weight, delay = line.split()
+            conns.append((int(src), int(tgt), float(weight), float(delay)))
+    return conns
+
+class allen_recipe(arb.recipe):
+    # synapse: add the expsyn target, not needed for cells run on their own
+    def __init__(self, cells, connections, cv_length=20, iclamp=(200, 1000, 0.15), store=None, synapse=True):
+        arb.recipe.__init__(self)
+        self.cells = cells
+        self.synapse = synapse
+        self.cv_length = cv_length
+        self.iclamp = iclamp
+        self.store = store
+        self.incoming = [[] for _ in cells]
+        for src, tgt, weight, delay in connections:
+            self.incoming[tgt].append(arb.connection(arb.cell_member(src, 0), arb.cell_member(tgt, 0), weight, delay))
+        # cells sharing reconstruction and fit share the description
+        self.descriptions = {}
+        self.props = arb.neuron_cable_properties()
+        self.props.catalogue = arb.allen_catalogue()
+        self.props.catalogue.extend(arb.default_catalogue(), '')
+
+    def num_cells(self):
+        return len(self.cells)
+
+    def cell_kind(self, gid):
+        return arb.cell_kind.cable
+
+    def cell_description(self, gid):
+        _, swc, fit = self.cells[gid]
+        if (swc, fit) not in self.descriptions:
+            cell = utils.make_allen_cell(swc, fit, self.cv_length, self.iclamp, store=self.store)
+            if self.synapse:
+                cell.place('"center"', arb.mechanism('expsyn'))
+            self.descriptions[(swc, fit)] = cell
+        return self.descriptions[(swc, fit)]
+
+    def num_sources(self, gid):
+        return 1
+
+    def num_targets(self, gid):
+        return 1 if self.synapse else 0
+
+    def connections_on(self, gid):
+        return self.incoming[gid]
+
+    def get_probes(self, gid):
+        return [arb.cable_probe_membrane_voltage('"center"')]
+
+    def global_properties(self, kind):
+        return self.props
+
+# Build and run the simulation; returns the spikes as (gid, time) arrays and
+# the voltage traces of the gids in probe as {gid: (time, voltage)}.
+# rec: optional phases.recorder, which also receives Arbor's meters
+def run_network(cells, connections, threads=None, tfinal=1400, dt=0.005, probe=[], frequency=10000, store=None, rec=None):
+    import os
+    import numpy as np
+    import phases
+
+    if rec is None:
+        rec = phases.recorder()
+    with rec.phase('recipe'):
+        recipe = allen_recipe(cells, connections, store=store)
+    context = arb.context(threads=threads or os.cpu_count())
+    rec.attach(context)
+    with rec.phase('decompose'):
+        decomp = arb.partition_load_balance(recipe, context)
+    with rec.phase('init'):
+        sim = arb.simulation(recipe, decomp, context)
+        sim.record(arb.spike_recording.all)
+        handles = {gid: sim.sample((gid, 0), arb.regular_schedule(1000.0/frequency)) for gid in probe}
+
+    with rec.phase('run'):
+        sim.run(tfinal, dt)
+
+    spikes = sim.spikes()
+    gids = np.asarray(spikes['source']['gid'], dtype=np.int64)
+    times = np.asarray(spikes['time'])
+    traces = {}
+    for gid, handle in handles.items():
+        data, _ = sim.samples(handle)[0]
+        traces[gid] = (data[:, 0], data[:, 1])
+    return gids, times, traces
+
+if __name__ == '__main__':
+    import argparse
+    import numpy as np
+    import batch
+    import cache
+
+    parser = argparse.ArgumentParser(description='Run a network of Allen models.')
+    parser.add_argument('cells', help='directory of cells or manifest file')
+    parser.add_argument('connections', help='connection table')
+    parser.add_argument('-o', '--out', default='network.npz', help='output file')
+    parser.add_argument('-t', '--threads', type=int, default=None, help='worker threads')
+    parser.add_argument('--tfinal', type=float, default=1400)
+    parser.add_argument('--dt', type=float, default=0.005)
+    parser.add_argument('--probe', type=int, nargs='*', default=[], help='gids to record voltage from')
+    parser.add_argument('--cache', default=None, help='cache directory for parsed inputs')
+    parser.add_argument('--profile', default=None, help='write a timing report to this file')
+    args = parser.parse_args()
+
+    import phases
+
+    cells = batch.read_manifest(args.cells)
+    store = cache.store(args.cache) if args.cache else None
+    rec = phases.recorder(cells=args.cells, tfinal=args.tfinal, dt=args.dt)
+    gids, times, traces = run_network(cells, read_connections(args.connections), args.threads,
+                                      args.tfinal, args.dt, args.probe, store=store, rec=rec)
+    if args.profile:
+        rec.write(args.profile)
+    np.savez(args.out, names=np.array([c[0] for c in cells]), gids=gids, times=times,
+             **{f'trace_{gid}': np.stack(tv) for gid, tv in traces.items()})
+    print(f'{len(cells)} cells, {len(times)} spikes')
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+# Phase timing and memory report for model runs.
+#
+# A recorder times named phases of a run, eg
+#
+#   rec = phases.recorder()
+#   with rec.phase('load'):
+#       ...
+#   rec.write('profile.json')
+#
+# and writes one JSON report per run. Per phase we keep wall and CPU time
+# and the peak resident set size of the process at its end, which exposes
+# the phase that raised the peak. All of this is read from counters the
+# process maintains anyway, so the recorder can stay on in production;
+# tracemalloc, which tracks Python allocations only and slows them down, is
+# opt-in. Arbor's meters and profiler summary are added where available.
+
+import os
+import json
+import time
+import resource
+from contextlib import contextmanager
+
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 # kB -> MB
+
+class recorder:
+    def __init__(self, python_memory=False, **info):
+        self.info = info
+        self.phases = []
+        self.python_memory = python_memory
+        self.meters = None
+        if python_memory:
+            import tracemalloc
+            tracemalloc.start()
+
+    # Checkpoint Arbor's meters at the end of every phase; only possible where
+    # the arb.context is accessible, ie not for single_cell_model.
+    def attach(self, context):
+        import arbor as arb
+
+        self.meters = (arb.meter_manager(), context)
+        self.meters[0].start(context)
+
+    @contextmanager
+    def phase(self, name):
+        if self.python_memory:
+            import tracemalloc
+            tracemalloc.reset_peak()
+        rss = peak_rss()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            entry = {'name': name,
+                     'wall': time.perf_counter() - wall,
+                     'cpu': time.process_time() - cpu,
+                     'peak_rss_mb': peak_rss(),
+                     'peak_rss_growth_mb': peak_rss() - rss}
+            if self.python_memory:
+                entry['python_peak_mb'] = tracemalloc.get_traced_memory()[1]/2**20
+            if self.meters is not None:
+                self.meters[0].checkpoint(name, self.meters[1])
+            self.phases.append(entry)
+
+    def report(self):
+        result = {**self.info,
+                  'pid': os.getpid(),
+                  'total_wall': sum(p['wall'] for p in self.phases),
+                  'peak_rss_mb': peak_rss(),
+                  'phases': self.phases}
+        if self.meters is not None:
+            import arbor as arb
+            result['arbor_meters'] = str(arb.meter_report(*self.meters))
+        try:
+            import arbor as arb
+            # only in builds with profiling enabled
+            result['arbor_profile'] = arb.profiler_summary()
+        except Exception:
+            pass
+        return result
+
+    def write(self, path):
+        with open(path, 'w') as fd:
+            json.dump(self.report(), fd, indent=1)
+
+# Table of all reports below path (eg the output of batch.py): one row per
+# run and phase
+def collect(path, name='profile.json'):
+    rows = []
+    for root, _, files in os.walk(path):
+        if name not in files:
+            continue
+        with open(os.path.join(root, name)) as fd:
+            report = json.load(fd)
+        run = os.path.relpath(root, path)
+        for p in report['phases']:
+            rows.append({'run': run, **p})
+    return rows
+
+# The steps of model.py as phases
+def profile_model(swc, fit, output=None, tfinal=1400, dt=0.005, plot=True):
+    import arbor as arb
+    import utils
+
+    rec = recorder(swc=swc, fit=fit, tfinal=tfinal, dt=dt)
+    with rec.phase('load_swc'):
+        morphology = arb.morphology(arb.load_swc_allen(swc, no_gaps=False))
+    with rec.phase('load_fit'):
+        params = utils.load_allen_fit(fit)
+    with rec.phase('paint'):
+        cell = arb.cable_cell(morphology, arb.label_dict(utils.allen_labels))
+        cell.compartments_length(20)
+        utils.paint_allen_fit(cell, *params)
+        cell.place('"center"', arb.iclamp(200, 1000, 0.15))
+        cell.place('"center"', arb.spike_detector(-40))
+    with rec.phase('catalogue'):
+        model = utils.make_allen_model(cell)
+    with rec.phase('run'):
+        model.run(tfinal=tfinal, dt=dt)
+    if plot:
+        with rec.phase('plot'):
+            utils.plot_results(model)
+    if output:
+        rec.write(output)
+    return rec.report()
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Profile the phases of model.py, or summarise batch reports.')
+    parser.add_argument('swc', nargs='?', default='cell.swc')
+    parser.add_argument('fit', nargs='?', default='fit.json')
+    parser.add_argument('-o', '--out', default='profile.json', help='report file')
+    parser.add_argument('--no-plot', action='store_true', help='skip plotting')
+    parser.add_argument('--collect', default=None, help='summarise the reports below this directory instead')
+    args = parser.parse_args()
+
+    if args.collect:
+        totals = {}
+        for row in collect(args.collect):
+            t = totals.setdefault(row['name'], [0, 0.0, 0.0])
+            t[0] += 1
+            t[1] += row['wall']
+            t[2] = max(t[2], row['peak_rss_mb'])
+        for name, (n, wall, peak) in totals.items():
+            print(f'{name:>12}: {n} runs, mean {wall/n:.2f}s, peak {peak:.0f}MB')
+    else:
+        report = profile_model(args.swc, args.fit, args.out, plot=not args.no_plot)
+        for p in report['phases']:
+            print(f'{p["name"]:>12}: {p["wall"]:.2f}s {p["peak_rss_mb"]:.0f}MB')
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# Parameter sweeps over a single Allen model.
+#
+# A design is a list of points, each a dict over the knobs
+#
+#   cv_length: maximum compartment length, cf. compartments_length(20)
+#   dt:        time step
+#   amplitude: iclamp amplitude
+#   <key>:     any fit value in the form accepted by utils.override_allen_fit,
+#              eg 'soma/NaV/gbar' or 'dend/cm'
+#
+# Results are appended to a CSV table one row per finished point, keyed by
+# a hash of the point, the contents of the SWC and fit files and tfinal;
+# rerunning a sweep on an existing table only computes the missing rows, and
+# rows of another cell or duration in the same table are never taken as done.
+#
+# With warm=True every point starts from the cached resting state of its
+# cell, see warmstart.py; points that only differ in the stimulus share one
+# checkpoint. Before any warm point runs, every distinct checkpoint of the
+# points still to do, ie every combination of cv_length, dt and fit values,
+# is checked once against a cold run, see warmstart.check, and the sweep
+# stops if one drifts too far. A design that varies fit values gains little
+# from warm starts, since most checkpoints then cost a cold run anyway.
+# Voltage statistics cover the time after the checkpoint, so warm rows are
+# stored with 'warm': true in params and keyed apart from cold rows of the
+# same point.
+
+import os
+import csv
+import json
+import time
+import hashlib
+
+knobs = {'cv_length': 20, 'dt': 0.005, 'amplitude': 0.15}
+
+columns = ['key', 'params', 'spike_count', 'spike_times',
+           'v_min', 'v_max', 'v_mean', 'v_std', 'elapsed', 'error']
+
+def grid(**axes):
+    import itertools
+
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+# Uniform random design; ranges are given as (low, high)
+def random(n, seed=0, **ranges):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    return [{k: float(rng.uniform(lo, hi)) for k, (lo, hi) in ranges.items()} for _ in range(n)]
+
+# Digest of everything outside the point that determines a row
+def inputs_digest(swc, fit, tfinal):
+    import cache
+
+    return cache.digest(cache.file_digest(swc), cache.file_digest(fit), repr(float(tfinal)))
+
+# The point as recorded in the table, with the run mode
+def point_params(point, warm=False):
+    return json.dumps({**point, 'warm': bool(warm)}, sort_keys=True)
+
+def point_key(point, inputs, warm=False):
+    return hashlib.sha1((inputs + point_params(point, warm)).encode()).hexdigest()[:16]
+
+# Knobs and fit overrides of a point
+def split_point(point):
+    knob = {**knobs, **{k: v for k, v in point.items() if k in knobs}}
+    overrides = {k: v for k, v in point.items() if k not in knobs}
+    return knob, overrides
+
+# The distinct warm start checkpoints of a design as (cv_length, dt, overrides)
+def checkpoints(design):
+    result = {}
+    for point in design:
+        knob, overrides = split_point(point)
+        key = json.dumps([knob['cv_length'], knob['dt'], overrides], sort_keys=True)
+        result.setdefault(key, (knob['cv_length'], knob['dt'], overrides))
+    return list(result.values())
+
+def check_checkpoint(checkpoint, swc, fit, tfinal=1400, frequency=200000, cache_dir=None):
+    import warmstart
+    import cache
+
+    cv_length, dt, overrides = checkpoint
+    store = cache.store(cache_dir) if cache_dir else None
+    result = warmstart.check(swc, fit, tfinal=tfinal, dt=dt, cv_length=cv_length,
+                             frequency=frequency, store=store, overrides=overrides)
+    return checkpoint, result
+
+def run_point(point, swc, fit, tfinal=1400, frequency=200000, cache_dir=None, warm=False):
+    import numpy as np
+    import utils
+    import cache
+
+    row = {'key': point_key(point, inputs_digest(swc, fit, tfinal), warm),
+           'params': point_params(point, warm)}
+    start = time.perf_counter()
+    try:
+        knob, overrides = split_point(point)
+        store = cache.store(cache_dir) if cache_dir else None
+        if warm:
+            import warmstart
+
+            spikes, _, voltages = warmstart.run_warm(swc, fit, tfinal=tfinal, dt=knob['dt'],
+                                                     cv_length=knob['cv_length'],
+                                                     iclamp=(200, 1000, knob['amplitude']),
+                                                     frequency=frequency, store=store,
+                                                     overrides=overrides)
+        else:
+            cell = utils.make_allen_cell(swc, fit, cv_length=knob['cv_length'],
+                                         iclamp=(200, 1000, knob['amplitude']),
+                                         store=store, overrides=overrides)
+            model = utils.make_allen_model(cell, frequency=frequency)
+            model.run(tfinal=tfinal, dt=knob['dt'])
+            spikes = np.array(model.spikes)
+            voltages = np.array(model.traces[0].value[:])
+        row.update(spike_count=len(spikes),
+                   spike_times=' '.join(f'{t:.4f}' for t in spikes),
+                   v_min=voltages.min(), v_max=voltages.max(),
+                   v_mean=voltages.mean(), v_std=voltages.std(),
+                   error='')
+    except Exception as e:
+        row['error'] = f'{type(e).__name__}: {e}'
+    row['elapsed'] = time.perf_counter() - start
+    return row
+
+def finished(table):
+    if not os.path.exists(table):
+        return set()
+    with open(table, newline='') as fd:
+        return {row['key'] for row in csv.DictReader(fd) if not row['error']}
+
+# Run all points of the design not yet finished in table, on a process pool.
+# Failed points are recorded but retried on the next invocation. With warm,
+# the checkpoints are checked first unless check is False.
+def run_sweep(design, swc, fit, table, processes=None, tfinal=1400, warm=False, check=True, **kwargs):
+    from multiprocessing import Pool
+    from functools import partial
+
+    done = finished(table)
+    inputs = inputs_digest(swc, fit, tfinal)
+    todo = [p for p in design if point_key(p, inputs, warm) not in done]
+    print(f'{len(design) - len(todo)}/{len(design)} points already done')
+
+    new = not os.path.exists(table)
+    with open(table, 'a', newline='') as fd, Pool(processes=processes) as pool:
+        if warm and check and todo:
+            task = partial(check_checkpoint, swc=swc, fit=fit, tfinal=tfinal, **kwargs)
+            failed = []
+            for (cv_length, dt, overrides), result in pool.imap_unordered(task, checkpoints(todo), chunksize=1):
+                print(f'checkpoint cv_length={cv_length} dt={dt} {json.dumps(overrides, sort_keys=True)}: '
+                      f'rmse={result["rmse"]:.3f}mV spike_shift={result["spike_shift"]:.3f}ms')
+                if not result['pass']:
+                    failed.append(json.dumps({'cv_length': cv_length, 'dt': dt, **overrides}, sort_keys=True))
+            if failed:
+                raise Exception(f"Warm start drifts from the cold run, see warmstart.tolerances: {', '.join(failed)}")
+        writer = csv.DictWriter(fd, fieldnames=columns)
+        if new:
+            writer.writeheader()
+        task = partial(run_point, swc=swc, fit=fit, tfinal=tfinal, warm=warm, **kwargs)
+        for row in pool.imap_unordered(task, todo, chunksize=1):
+            writer.writerow(row)
+            # flush each row, so an interrupted sweep keeps everything finished
+            fd.flush()
+            print(f'{row["params"]}: {row["error"] or str(row["spike_count"]) + " spikes"} ({row["elapsed"]:.1f}s)')
+
+def load_results(table):
+    import pandas as pd
+
+    df = pd.read_csv(table, keep_default_na=False)
+    params = pd.DataFrame([json.loads(p) for p in df['params']], index=df.index)
+    return pd.concat([params, df.drop(columns=['params'])], axis=1)
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Sweep parameters of an Allen model.',
+                                     epilog='Axes are given as NAME=V1,V2,... for grids or NAME=LO:HI for random designs.')
+    parser.add_argument('swc')
+    parser.add_argument('fit')
+    parser.add_argument('axes', nargs='+', help='sweep axes')
+    parser.add_argument('-o', '--out', default='sweep.csv', help='result table')
+    parser.add_argument('-j', '--processes', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('-n', '--samples', type=int, default=None, help='random design with this many points')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tfinal', type=float, default=1400)
+    parser.add_argument('--cache', default=None, help='cache directory for parsed inputs')
+    parser.add_argument('--warm', action='store_true', help='start every point from the cached resting state')
+    args = parser.parse_args()
+
+    axes = dict(axis.split('=', 1) for axis in args.axes)
+    if args.samples is None:
+        design = grid(**{k: [float(v) for v in vs.split(',')] for k, vs in axes.items()})
+    else:
+        design = random(args.samples, args.seed, **{k: tuple(float(v) for v in vs.split(':')) for k, vs in axes.items()})
+    swc, fit = os.path.abspath(args.swc), os.path.abspath(args.fit)
+    run_sweep(design, swc, fit, args.out, args.processes,
+              tfinal=args.tfinal, cache_dir=args.cache, warm=args.warm)
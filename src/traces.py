@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# Append-only on-disk trace storage.
+#
+# A trace directory holds one raw float64 file per series, eg
+#
+#   <dir>/spikes.f64  <dir>/time0.f64  <dir>/value0.f64
+#
+# run_streaming moves the samples of a running simulation to disk chunk by
+# chunk, so no full trace is ever held in memory. Series are read back as
+# read-only memory maps, so analysis and plotting only touch the pages they
+# need.
+
+import os
+import numpy as np
+
+dtype = np.float64
+
+class trace_sink:
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        os.makedirs(path, exist_ok=True)
+
+    def append(self, name, values):
+        if name not in self.files:
+            self.files[name] = open(os.path.join(self.path, name + '.f64'), 'wb')
+        np.asarray(values, dtype=dtype).tofile(self.files[name])
+
+    def close(self):
+        for fd in self.files.values():
+            fd.close()
+        self.files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def open_trace(path, name):
+    fn = os.path.join(path, name + '.f64')
+    if os.path.getsize(fn) == 0: # cannot map empty files
+        return np.empty(0, dtype=dtype)
+    return np.memmap(fn, dtype=dtype, mode='r')
+
+# Dump spikes and traces of a single_cell_model after the run. The model
+# holds every sample in memory anyway; each of its vectors is converted once,
+# as every attribute access copies the whole vector.
+def write_model(model, path):
+    with trace_sink(path) as sink:
+        sink.append('spikes', model.spikes)
+        for i, trace in enumerate(model.traces):
+            sink.append(f'time{i}', trace.time)
+            sink.append(f'value{i}', trace.value)
+
+# Run an arb.simulation up to tfinal in steps of length chunk and move the
+# samples of the given probes to disk after each step. Samplers are re-added
+# per step, so Arbor never buffers more than one step worth of samples.
+#
+#   probes: {name: probe id}, eg {'0': (0, 0)}, written as the series
+#           time<name> and value<name>, the layout of write_model
+def run_streaming(sim, probes, path, tfinal, dt, frequency=200000, chunk=100):
+    import arbor as arb
+
+    sim.record(arb.spike_recording.all)
+    with trace_sink(path) as sink:
+        t = 0
+        while t < tfinal:
+            stop = min(t + chunk, tfinal)
+            handles = {name: sim.sample(pid, arb.regular_schedule(t, 1000.0/frequency, stop))
+                       for name, pid in probes.items()}
+            sim.run(stop, dt)
+            for name, handle in handles.items():
+                for data, _ in sim.samples(handle):
+                    sink.append(f'time{name}', data[:, 0])
+                    sink.append(f'value{name}', data[:, 1])
+                sim.remove_sampler(handle)
+            t = stop
+        spikes = sim.spikes()
+        sink.append('spikes', spikes['time'])
+        sink.append('gids', spikes['source']['gid'])
+
+# Plot a trace directory written by write_model or run_streaming, see
+# utils.plot_voltage
+def plot(path, output='arbor.pdf', downsample=True):
+    import utils
+
+    utils.plot_voltage(open_trace(path, 'spikes'),
+                       open_trace(path, 'time0'),
+                       open_trace(path, 'value0'),
+                       output, downsample)
+
+if __name__ == '__main__':
+    import sys
+
+    plot(sys.argv[1], *sys.argv[2:])
@@ -64,26 +64,218 @@ def load_allen_fit(fit):
 
     return default, param, erev, mechs
 
-def plot_results(model):
+# Same as load_allen_fit, but keyed by the hash of the fit file in a
+# cache.store; warm loads unpickle the result instead of decoding JSON.
+def load_allen_fit_cached(fit, store=None):
+    import pickle
+    import cache
+
+    if store is None:
+        store = cache.store()
+    key = cache.file_digest(fit, 'allen-fit', str(pickle.HIGHEST_PROTOCOL))
+    data = store.get(key)
+    if data is not None:
+        return pickle.loads(data)
+    result = load_allen_fit(fit)
+    store.put(key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+    return result
+
+# Segment tree of an SWC file, keyed by the hash of the file and loader
+# options in a cache.store. Warm loads rebuild the tree from a flat binary
+# table instead of parsing the text, but still read and hash the file and
+# make three calls into arbor per segment: for cell.swc (4.8k segments) the
+# Python side alone takes about 12ms, so this is not known to beat
+# load_swc_allen and make_allen_cell does not use it.
+segment_dtype = [('parent', 'i8'), ('tag', 'i4'),
+                 ('prox', 'f8', 4), ('dist', 'f8', 4)] # x, y, z, radius
+
+def load_swc_cached(swc, store=None, no_gaps=False):
+    import io
+    import numpy as np
+    import arbor as arb
+    import cache
+
+    if store is None:
+        store = cache.store()
+    key = cache.file_digest(swc, 'swc-allen', str(no_gaps))
+    data = store.get(key)
+    if data is not None:
+        table = np.load(io.BytesIO(data))
+        tree = arb.segment_tree()
+        tree.reserve(len(table))
+        for parent, tag, p, d in table.tolist():
+            tree.append(arb.mnpos if parent < 0 else parent,
+                        arb.mpoint(*p), arb.mpoint(*d), tag=tag)
+        return tree
+
+    tree = arb.load_swc_allen(swc, no_gaps=no_gaps)
+    table = np.empty(tree.size, dtype=segment_dtype)
+    for i, (parent, seg) in enumerate(zip(tree.parents, tree.segments)):
+        p, d = seg.prox, seg.dist
+        table[i] = (-1 if parent == arb.mnpos else parent, seg.tag,
+                    (p.x, p.y, p.z, p.radius), (d.x, d.y, d.z, d.radius))
+    buf = io.BytesIO()
+    np.save(buf, table)
+    store.put(key, buf.getvalue())
+    return tree
+
+# Override single values of a parsed fit. Keys are 'region/name' for cell
+# properties (cm, rL, Vm, tempK) and 'region/mechanism/name' for mechanism
+# parameters, eg {'soma/NaV/gbar': 0.05, 'dend/cm': 0.02}.
+def override_allen_fit(default, regions, ions, mechanisms, overrides):
+    import copy
+
+    regions = copy.deepcopy(regions)
+    mechanisms = copy.deepcopy(mechanisms)
+    for key, value in overrides.items():
+        parts = key.split('/')
+        if len(parts) == 2:
+            region, name = parts
+            vs = [vs for r, vs in regions if r == region]
+            if not vs:
+                vs = [parameters()]
+                regions.append((region, vs[0]))
+            if not hasattr(vs[0], name):
+                raise Exception(f"Unknown key: {name}")
+            setattr(vs[0], name, float(value))
+        elif len(parts) == 3:
+            region, mech, name = parts
+            vs = [vs for r, m, vs in mechanisms if r == region and m == mech]
+            if not vs:
+                raise Exception(f"No mechanism {mech} on {region}")
+            vs[0][name] = float(value)
+        else:
+            raise Exception(f"Illegal override {key}")
+    return default, regions, ions, mechanisms
+
+# Labels shared by all Allen models: SWC tags and the center of the soma
+allen_labels = {'soma': '(tag 1)', 'axon': '(tag 2)',
+                'dend': '(tag 3)', 'apic': '(tag 4)',
+                'center': '(location 0 0.5)'}
+
+# Set defaults and override by region, reversal potentials and ion dynamics;
+# same as step 4 in model.py
+def paint_allen_fit(cell, default, regions, ions, mechanisms):
+    import arbor as arb
+
+    cell.set_properties(tempK=default.tempK, Vm=default.Vm,
+                        cm=default.cm, rL=default.rL)
+    for region, vs in regions:
+        cell.paint('"'+region+'"', tempK=vs.tempK, Vm=vs.Vm, cm=vs.cm, rL=vs.rL)
+    for region, ion, e in ions:
+        cell.paint('"'+region+'"', ion, rev_pot=e)
+    cell.set_ion('ca', int_con=5e-5, ext_con=2.0, method=arb.mechanism('nernst/x=ca'))
+    for region, mech, values in mechanisms:
+        cell.paint('"'+region+'"', arb.mechanism(mech, values))
+
+# Build the cell from model.py for arbitrary SWC and fit files
+#
+#   cv_length: maximum compartment length
+#   iclamp:    (start, duration, amplitude) of the stimulus, None to skip
+#   threshold: spike detector threshold
+#   store:     cache.store for the parsed fit, None to parse every time
+#   overrides: fit values to replace, see override_allen_fit
+#   resting:   initial membrane potential per branch {branch: Vm}, replacing
+#              the Vm of the fit, see warmstart.py
+def make_allen_cell(swc, fit, cv_length=20, iclamp=(200, 1000, 0.15), threshold=-40, store=None, overrides=None, resting=None):
+    import arbor as arb
+
+    if store is None:
+        fit = load_allen_fit(fit)
+    else:
+        fit = load_allen_fit_cached(fit, store)
+    morphology = arb.morphology(arb.load_swc_allen(swc, no_gaps=False))
+    cell = arb.cable_cell(morphology, arb.label_dict(allen_labels))
+    cell.compartments_length(cv_length)
+    if overrides:
+        fit = override_allen_fit(*fit, overrides)
+    if resting:
+        import copy
+
+        # the fit's Vm per region would overlap the Vm per branch
+        default, regions, ions, mechanisms = fit
+        regions = copy.deepcopy(regions)
+        for _, vs in regions:
+            vs.Vm = None
+        fit = default, regions, ions, mechanisms
+    paint_allen_fit(cell, *fit)
+    if resting:
+        for branch, vm in resting.items():
+            cell.paint(f'(branch {branch})', Vm=vm)
+    if iclamp is not None:
+        cell.place('"center"', arb.iclamp(*iclamp))
+    cell.place('"center"', arb.spike_detector(threshold))
+    return cell
+
+# Wrap a cell into a single cell model with the Allen catalogue and an
+# optional voltage probe at the soma center; frequency=None skips the probe.
+def make_allen_model(cell, frequency=200000):
+    import arbor as arb
+
+    model = arb.single_cell_model(cell)
+    if frequency is not None:
+        model.probe('voltage', '"center"', frequency=frequency)
+    model.properties.catalogue = arb.allen_catalogue()
+    model.properties.catalogue.extend(arb.default_catalogue(), '')
+    return model
+
+def plot_results(model, downsample=False):
+    import numpy as np
+
+    plot_voltage(np.array(model.spikes),
+                 np.array(model.traces[0].time[:]),
+                 np.array(model.traces[0].value[:]),
+                 downsample=downsample)
+
+# Reduce a regularly sampled trace to the minimum and maximum of each of n
+# buckets, in temporal order. Peaks survive, so spikes stay visible at any
+# resolution with at least one bucket per pixel.
+def minmax_downsample(times, values, n):
+    import numpy as np
+
+    times = np.asarray(times)
+    values = np.asarray(values)
+    if len(values) <= 2*n:
+        return times, values
+    k = -(-len(values) // n) # bucket size
+    m = len(values) // k     # number of full buckets
+    full = values[:m*k].reshape(m, k)
+    offset = np.arange(m)*k
+    idx = [np.sort(np.stack([offset + full.argmin(axis=1),
+                             offset + full.argmax(axis=1)], axis=1), axis=1).ravel()]
+    if m*k < len(values):
+        tail = values[m*k:]
+        idx.append(np.sort([m*k + tail.argmin(), m*k + tail.argmax()]))
+    idx = np.concatenate(idx)
+    return times[idx], values[idx]
+
+# Plot spikes and voltage trace against the reference; works on any array
+# like, eg the memory-mapped traces from traces.open_trace.
+#
+#   downsample: reduce both traces to min/max per pixel column before drawing
+def plot_voltage(spikes, times, voltages, output='arbor.pdf', downsample=False):
     import matplotlib.pyplot as plt
     import matplotlib.patches as patches
     import seaborn as sns
     import numpy as np
     import pandas as pd
 
-    spikes    = np.array(model.spikes)
-    times     = np.array(model.traces[0].time[:])
-    voltages  = np.array(model.traces[0].value[:])
     reference = pd.read_csv('nrn.csv')
+    ref_times = reference['t/ms'].to_numpy()
+    ref_voltages = reference['U/mV'].to_numpy()
 
     fg, ax = plt.subplots()
+    if downsample:
+        pixels = int(fg.get_figwidth()*fg.dpi)
+        times, voltages = minmax_downsample(times, voltages, pixels)
+        ref_times, ref_voltages = minmax_downsample(ref_times, ref_voltages, pixels)
     ax.scatter(spikes, np.zeros_like(spikes) - 40, color=sns.color_palette()[1], zorder=20, label='Spike')
     ax.plot(times, voltages + 14.0, label='Arbor', zorder=15) # need to shift by junction potential, see allen db
-    ax.plot(reference['t/ms'], 1000.0*reference['U/mV'], label='Reference', color='0.4', ls='--', zorder=10) # neuron outputs V instead of mV
+    ax.plot(ref_times, 1000.0*ref_voltages, label='Reference', color='0.4', ls='--', zorder=10) # neuron outputs V instead of mV
     ax.bar(200, 140, 1000, -120, align='edge', label='Stimulus', color='0.9')
     ax.set_xlabel('t/ms')
     ax.set_ylabel('U/mV')
     ax.set_xlim(left=0, right=1400)
     ax.set_ylim(top=20, bottom=-80)
     ax.legend(loc='upper left', bbox_to_anchor=(1.05, 1))
-    plt.savefig("arbor.pdf", bbox_inches='tight')
+    plt.savefig(output, bbox_inches='tight')
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# Quantitative comparison of Arbor runs against NEURON reference traces.
+#
+# Both traces are resampled onto a common time base, then we compute the
+# voltage RMSE, the alignment of threshold crossings and the firing rate
+# error. The NEURON output is in V and not corrected for the junction
+# potential, so the Arbor trace is shifted by the junction potential from
+# the fit file and the reference scaled by 1000, cf. utils.plot_voltage.
+
+import os
+import io
+import json
+import numpy as np
+
+# pass/fail limits
+tolerances = {'rmse': 5.0,          # mV
+              'spike_shift': 2.0,   # ms, mean over matched spikes
+              'rate_error': 0.1}    # relative
+
+def junction_potential(fit):
+    with open(fit) as fd:
+        return float(json.load(fd)['fitting'][0]['junction_potential'])
+
+# Read a reference CSV into an (n, 2) array of time/ms and voltage/mV. The
+# parsed array is kept in a cache.store, so every CSV is parsed only once.
+def load_reference(csv, store=None):
+    import cache
+
+    if store is None:
+        store = cache.store()
+    key = cache.file_digest(csv, 'nrn-reference')
+    data = store.get(key)
+    if data is not None:
+        return np.load(io.BytesIO(data))
+
+    import pandas as pd
+
+    reference = pd.read_csv(csv)
+    result = np.stack([reference['t/ms'].to_numpy(dtype=np.float64),
+                       1000.0*reference['U/mV'].to_numpy(dtype=np.float64)], axis=1)
+    buf = io.BytesIO()
+    np.save(buf, result)
+    store.put(key, buf.getvalue())
+    return result
+
+# Times of upward crossings of threshold, linearly interpolated
+def crossings(times, values, threshold):
+    above = values >= threshold
+    idx = np.flatnonzero(~above[:-1] & above[1:])
+    t0, t1 = times[idx], times[idx+1]
+    v0, v1 = values[idx], values[idx+1]
+    return t0 + (threshold - v0)*(t1 - t0)/(v1 - v0)
+
+# Compare one Arbor trace against its reference on a grid of spacing step.
+def compare(times, voltages, reference, shift=14.0, threshold=-40.0, step=0.025):
+    times = np.asarray(times)
+    voltages = np.asarray(voltages) + shift
+    lo = max(times[0], reference[0, 0])
+    hi = min(times[-1], reference[-1, 0])
+    grid = np.arange(lo, hi, step)
+    arb = np.interp(grid, times, voltages)
+    ref = np.interp(grid, reference[:, 0], reference[:, 1])
+
+    # Detect on the shifted traces, at the detector threshold of model.py
+    arb_spikes = crossings(grid, arb, threshold + shift)
+    ref_spikes = crossings(grid, ref, threshold + shift)
+    if len(arb_spikes) and len(ref_spikes):
+        # match every reference spike with the closest Arbor spike
+        idx = np.clip(np.searchsorted(arb_spikes, ref_spikes), 1, len(arb_spikes)) - 1
+        nxt = np.minimum(idx + 1, len(arb_spikes) - 1)
+        shifts = np.minimum(np.abs(arb_spikes[idx] - ref_spikes), np.abs(arb_spikes[nxt] - ref_spikes))
+        spike_shift = float(shifts.mean())
+    elif len(arb_spikes) == len(ref_spikes):
+        spike_shift = 0.0
+    else:
+        spike_shift = float('inf')
+
+    return {'rmse': float(np.sqrt(np.mean((arb - ref)**2))),
+            'spike_shift': spike_shift,
+            'rate_error': abs(len(arb_spikes) - len(ref_spikes))/max(len(ref_spikes), 1),
+            'arbor_spikes': len(arb_spikes),
+            'reference_spikes': len(ref_spikes)}
+
+def check(result, limits=tolerances):
+    return all(result[k] <= v for k, v in limits.items())
+
+# Validate the output of batch.py; the reference for a cell is the nrn.csv
+# next to its fit file.
+def validate_batch(jobs, out, limits=tolerances, store=None, **kwargs):
+    import traces
+
+    report = {}
+    for name, swc, fit in jobs:
+        csv = os.path.join(os.path.dirname(fit), 'nrn.csv')
+        path = os.path.join(out, name)
+        try:
+            result = compare(traces.open_trace(path, 'time0'),
+                             traces.open_trace(path, 'value0'),
+                             load_reference(csv, store),
+                             shift=-junction_potential(fit), **kwargs)
+            result['pass'] = check(result, limits)
+        except Exception as e:
+            result = {'pass': False, 'error': f'{type(e).__name__}: {e}'}
+        report[name] = result
+    return report
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+    import batch
+    import cache
+
+    parser = argparse.ArgumentParser(description='Validate batch output against NEURON references.')
+    parser.add_argument('input', help='directory of cells or manifest file, as given to batch.py')
+    parser.add_argument('-o', '--out', default='out', help='batch output directory')
+    parser.add_argument('-r', '--report', default='validation.json', help='report file')
+    parser.add_argument('--cache', default=None, help='cache directory for parsed references')
+    for k, v in tolerances.items():
+        parser.add_argument('--' + k.replace('_', '-'), type=float, default=v, help=f'limit for {k}')
+    args = parser.parse_args()
+
+    limits = {k: getattr(args, k) for k in tolerances}
+    store = cache.store(args.cache) if args.cache else None
+    report = validate_batch(batch.read_manifest(args.input), args.out, limits, store)
+    with open(args.report, 'w') as fd:
+        json.dump(report, fd, indent=2)
+    for name, result in report.items():
+        if 'error' in result:
+            print(f'{name:>20}: FAIL {result["error"]}')
+        else:
+            print(f'{name:>20}: {"pass" if result["pass"] else "FAIL"} '
+                  f'rmse={result["rmse"]:.2f}mV spike_shift={result["spike_shift"]:.2f}ms rate_error={result["rate_error"]:.2f}')
+    sys.exit(0 if all(r['pass'] for r in report.values()) else 1)
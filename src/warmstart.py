@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# Warm start of Allen models from a checkpointed resting state.
+#
+# model.py integrates 200ms of unstimulated membrane before the stimulus
+# starts. The state reached at that point only depends on the morphology,
+# the fit and the discretisation, so it is computed once, stored in a
+# cache.store, and later runs start from it and only simulate the rest.
+#
+# Arbor cannot serialise a running simulation, so the checkpoint is only the
+# membrane potential at the middle of every branch. A warm run paints it as
+# the initial Vm of the whole branch. Gating variables restart at their steady
+# state for that potential, and ion concentrations, eg internal Ca, at their
+# initial values, so a warm run is an approximation of the cold run, not its
+# continuation. check compares both for a cell against the tolerances below.
+# Warm runs begin at the checkpoint time; their results are shifted so times
+# line up with a cold run.
+
+import json
+
+# checkpoint time, the start of the stimulus in model.py
+t_rest = 200
+
+# Accepted drift of a warm run from the cold run, after the checkpoint: a
+# fifth of the limits of validate.tolerances against NEURON, and the same
+# number of spikes. Drift adds to the error of the cold run, so a cell
+# validated close to those limits may still fail them when started warm.
+tolerances = {'rmse': 1.0,          # mV
+              'spike_shift': 0.4,   # ms, mean over matched spikes
+              'rate_error': 0.0}    # relative
+
+def checkpoint_key(swc, fit, cv_length, dt, t, overrides):
+    import cache
+
+    return cache.digest(cache.file_digest(swc), cache.file_digest(fit), 'resting-state',
+                        json.dumps([cv_length, dt, t, overrides or {}], sort_keys=True))
+
+# Membrane potential {branch: Vm} after t ms without stimulus
+def resting_state(swc, fit, cv_length=20, dt=0.005, t=t_rest, store=None, overrides=None):
+    import cache
+    import utils
+
+    if store is None:
+        store = cache.store()
+    key = checkpoint_key(swc, fit, cv_length, dt, t, overrides)
+    data = store.get(key)
+    if data is not None:
+        return {int(b): v for b, v in json.loads(data)}
+
+    cell = utils.make_allen_cell(swc, fit, cv_length=cv_length, iclamp=None,
+                                 store=store, overrides=overrides)
+    model = utils.make_allen_model(cell, frequency=None)
+    # Sample with period t, ie only at 0 and t; samples are taken strictly
+    # before tfinal, so run one more step.
+    model.probe('voltage', '(on_branches 0.5)', frequency=1000.0/t)
+    model.run(tfinal=t + dt, dt=dt)
+    state = {trace.location.branch: float(trace.value[-1]) for trace in model.traces}
+    store.put(key, json.dumps(sorted(state.items())).encode())
+    return state
+
+# Run from the resting state at t; returns spikes, sample times and voltages
+# at the soma center, with times as in a cold run starting at 0
+def run_warm(swc, fit, tfinal=1400, dt=0.005, cv_length=20, iclamp=(200, 1000, 0.15),
+             frequency=200000, t=t_rest, store=None, overrides=None):
+    import numpy as np
+    import utils
+
+    start, duration, amplitude = iclamp
+    if start < t:
+        raise Exception(f"Stimulus starts at {start}ms, before the checkpoint at {t}ms")
+    state = resting_state(swc, fit, cv_length, dt, t, store, overrides)
+    cell = utils.make_allen_cell(swc, fit, cv_length=cv_length,
+                                 iclamp=(start - t, duration, amplitude),
+                                 store=store, overrides=overrides, resting=state)
+    model = utils.make_allen_model(cell, frequency=frequency)
+    model.run(tfinal=tfinal - t, dt=dt)
+    return (np.array(model.spikes) + t,
+            np.array(model.traces[0].time[:]) + t,
+            np.array(model.traces[0].value[:]))
+
+# Compare run_warm against a cold run of the same cell with validate.compare;
+# returns its result with 'pass' set according to limits
+def check(swc, fit, tfinal=1400, dt=0.005, cv_length=20, iclamp=(200, 1000, 0.15),
+          frequency=200000, t=t_rest, store=None, overrides=None, limits=tolerances):
+    import numpy as np
+    import utils
+    import validate
+
+    cell = utils.make_allen_cell(swc, fit, cv_length=cv_length, iclamp=iclamp,
+                                 store=store, overrides=overrides)
+    model = utils.make_allen_model(cell, frequency=frequency)
+    model.run(tfinal=tfinal, dt=dt)
+    cold = np.stack([np.array(model.traces[0].time), np.array(model.traces[0].value)], axis=1)
+    _, times, voltages = run_warm(swc, fit, tfinal, dt, cv_length, iclamp, frequency, t, store, overrides)
+    # the grid of compare starts at the later start, ie the checkpoint
+    result = validate.compare(times, voltages, cold, shift=0.0)
+    result['pass'] = validate.check(result, limits)
+    return result
+
+if __name__ == '__main__':
+    import sys
+    import argparse
+    import cache
+
+    parser = argparse.ArgumentParser(description='Compute and store the resting state of an Allen model.')
+    parser.add_argument('swc')
+    parser.add_argument('fit')
+    parser.add_argument('--cv-length', type=float, default=20)
+    parser.add_argument('--dt', type=float, default=0.005)
+    parser.add_argument('--time', type=float, default=t_rest, help='checkpoint time')
+    parser.add_argument('--cache', default=None, help='cache directory')
+    parser.add_argument('--check', action='store_true', help='compare a warm against a cold run')
+    args = parser.parse_args()
+
+    store = cache.store(args.cache) if args.cache else None
+    if args.check:
+        result = check(args.swc, args.fit, dt=args.dt, cv_length=args.cv_length, t=args.time, store=store)
+        print(f'{"pass" if result["pass"] else "FAIL"}: rmse={result["rmse"]:.3f}mV '
+              f'spike_shift={result["spike_shift"]:.3f}ms spikes={result["arbor_spikes"]}/{result["reference_spikes"]}')
+        sys.exit(0 if result['pass'] else 1)
+    state = resting_state(args.swc, args.fit, args.cv_length, args.dt, args.time, store)
+    for branch, vm in sorted(state.items()):
+        print(f'{branch:>5}: {vm:.3f}mV')